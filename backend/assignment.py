@@ -0,0 +1,130 @@
+import datetime
+import os
+import numpy as np
+from travel_matrix import travel_matrix, estimate_seconds
+
+# Above this many drivers or rides, solve greedily instead of optimally
+GREEDY_THRESHOLD = int(os.getenv("ASSIGNMENT_GREEDY_THRESHOLD", "1000"))
+# Seconds of pickup time traded per second a ride has already waited,
+# so far-away rides are not starved when riders outnumber drivers
+WAIT_WEIGHT = float(os.getenv("ASSIGNMENT_WAIT_WEIGHT", "0.5"))
+
+
+# ----------------------------
+# Cost Matrix
+# ----------------------------
+def _positions(items, key=None):
+    points = [item[key] if key else item for item in items]
+    return np.array([[float(p["lat"]), float(p["lon"])] for p in points], dtype=np.float64).reshape(-1, 2)
+
+
+def travel_seconds_matrix(origins, destinations):
+    """(n, m) drive-time estimates between (n, 2) and (m, 2) [lat, lon] arrays"""
+    n, m = len(origins), len(destinations)
+    if travel_matrix is not None:
+        o = np.repeat(origins, m, axis=0)
+        d = np.tile(destinations, (n, 1))
+        return travel_matrix.estimate_many(o, d).reshape(n, m)
+    return estimate_seconds(
+        origins[:, 0:1], origins[:, 1:2], destinations[None, :, 0], destinations[None, :, 1]
+    )
+
+
+def build_cost_matrix(drivers, rides, now=None, wait_weight=WAIT_WEIGHT):
+    """Driver x ride cost: seconds to reach the pickup, discounted by time already waited"""
+    cost = travel_seconds_matrix(_positions(drivers), _positions(rides, "pickup"))
+    if wait_weight:
+        now = now or datetime.datetime.utcnow()
+        waited = np.array([
+            (now - datetime.datetime.fromisoformat(r["timestamp"])).total_seconds() if r.get("timestamp") else 0.0
+            for r in rides
+        ])
+        cost = cost - wait_weight * waited[None, :]
+    return cost
+
+
+# ----------------------------
+# Solvers
+# ----------------------------
+def hungarian(cost):
+    """
+    Min-cost assignment (shortest augmenting path form of the Hungarian
+    algorithm), O(n^2 m) with the inner column loop vectorized.
+    Requires n <= m; returns the column chosen for each row.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.intp)  # p[j] = row (1-based) matched to column j
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free & (reduced < minv[1:])
+            minv[1:][improve] = reduced[improve]
+            way[1:][improve] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.empty(n, dtype=np.intp)
+    for j in range(1, m + 1):
+        if p[j]:
+            cols[p[j] - 1] = j - 1
+    return cols
+
+
+def greedy(cost):
+    """Cheapest-pair-first matching; near-optimal and O(nm log nm)"""
+    n, m = cost.shape
+    pairs = []
+    used_rows = np.zeros(n, dtype=bool)
+    used_cols = np.zeros(m, dtype=bool)
+    for flat in np.argsort(cost, axis=None, kind="stable"):
+        r, c = divmod(int(flat), m)
+        if used_rows[r] or used_cols[c]:
+            continue
+        used_rows[r] = used_cols[c] = True
+        pairs.append((r, c))
+        if len(pairs) == min(n, m):
+            break
+    return pairs
+
+
+def solve_assignment(cost, greedy_threshold=GREEDY_THRESHOLD):
+    """List of (row, col) pairs covering min(n, m) rows/cols"""
+    n, m = cost.shape
+    if n == 0 or m == 0:
+        return []
+    if max(n, m) > greedy_threshold:
+        return greedy(cost)
+    if n <= m:
+        return list(enumerate(hungarian(cost).tolist()))
+    cols = hungarian(cost.T)
+    return [(int(r), c) for c, r in enumerate(cols.tolist())]
+
+
+def plan_assignments(drivers, rides, now=None, greedy_threshold=GREEDY_THRESHOLD):
+    """Match available drivers to waiting rides; returns [(driver, ride)]"""
+    if not drivers or not rides:
+        return []
+    cost = build_cost_matrix(drivers, rides, now)
+    return [(drivers[r], rides[c]) for r, c in solve_assignment(cost, greedy_threshold)]
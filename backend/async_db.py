@@ -0,0 +1,95 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import bedrock
+import db
+from queue_eta import queue_eta
+from route_tracker import route_tracker
+from queue_snapshot import queue_snapshot
+
+# ----------------------------
+# Executor
+# ----------------------------
+# Bounded pool for blocking boto3 calls, sized to the boto connection pool
+executor = ThreadPoolExecutor(
+    max_workers=db.AWS_MAX_POOL_CONNECTIONS,
+    thread_name_prefix="db"
+)
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking data-layer call on the db executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    executor.shutdown(wait=True)
+    # Durable flush of buffered driver positions
+    db.driver_locations.close()
+
+
+# ----------------------------
+# Async Data Access
+# ----------------------------
+async def geocode_address(address_text):
+    return await run(db.geocode_address, address_text)
+
+async def calculate_route_minutes_seconds(pickup, destination):
+    return await run(db.calculate_route_minutes_seconds, pickup, destination)
+
+async def get_in_car_eta(ride_id, position, destination):
+    # Usually a local projection onto the tracked route; a reroute call when off-route
+    return await run(route_tracker.eta_seconds, ride_id, position, destination)
+
+async def create_ride(name, uw_id, pickup, destination, notes=""):
+    return await run(db.create_ride, name, uw_id, pickup, destination, notes)
+
+async def get_waiting_rides():
+    return await run(db.get_waiting_rides)
+
+async def update_ride_status(ride_id, status, driver_id=None):
+    return await run(db.update_ride_status, ride_id, status, driver_id)
+
+async def update_driver_location(driver_id, lat, lon, available=True, current_ride_id=None):
+    return await run(db.update_driver_location, driver_id, lat, lon, available, current_ride_id)
+
+def record_driver_ping(driver_id, lat, lon, ride_ids=()):
+    # In-memory only, so no executor hop is needed
+    db.record_driver_ping(driver_id, lat, lon, ride_ids)
+
+async def get_ride_by_id(ride_id):
+    return await run(db.get_ride_by_id, ride_id)
+
+async def get_driver_by_id(driver_id):
+    return await run(db.get_driver_by_id, driver_id)
+
+async def assign_next_ride():
+    return await run(db.assign_next_ride)
+
+async def assign_pools():
+    return await run(db.assign_pools)
+
+async def accept_ride_transaction(driver_id, ride_id):
+    return await run(db.accept_ride_transaction, driver_id, ride_id)
+
+async def complete_ride_transaction(ride_id):
+    return await run(db.complete_ride_transaction, ride_id)
+
+async def get_queue_snapshot():
+    # Shared by every driver; a stale snapshot is rebuilt once, on the executor
+    return await run(queue_snapshot.get)
+
+async def get_queue_eta(ride_id):
+    # May trigger a snapshot rebuild (route lookups), so it also runs off the loop
+    return await run(queue_eta.get, ride_id)
+
+async def get_queue_etas():
+    return await run(queue_eta.all)
+
+
+# ----------------------------
+# Ride Request Parsing
+# ----------------------------
+async def parse_pickup_and_destination(pickup_text, destination_text):
+    return await run(bedrock.parse_pickup_and_destination, pickup_text, destination_text)
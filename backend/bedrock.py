@@ -1,7 +1,11 @@
 import boto3
+import hashlib
 import json
 import os
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
+from metrics import instrument_boto_client
 
 
 load_dotenv()
@@ -13,22 +17,49 @@ bedrock = boto3.client(
     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY_BEDROCK")
 )
 
-def parse_ride_request(user_input: str):
-    """
-    Uses Amazon Bedrock to extract location info from a natural language request.
-    """
-    prompt = f"""
-    You're a smart ride assistant helping students around the University of Washington campus.
-    Extract locations from this casual ride request.
-    Return a JSON object with one key: "location".
-    If either location is missing or unclear, return null for that field.
-    Request: "{user_input}"
-    """
+# Riders' text is parsed on the API server (/parse_ride_request), so model
+# call counts and latencies show up in its /metrics
+instrument_boto_client(bedrock)
+
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+# MODEL_ID = "anthropic.claude-haiku-4-5-20251001-v1:0"
+
+# ----------------------------
+# Extraction Cache
+# ----------------------------
+EXTRACTION_CACHE_SIZE = int(os.getenv("BEDROCK_CACHE_SIZE", "1024"))
+_extraction_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_key(user_input: str):
+    # Hash of model + normalized text, so identical inputs are never re-sent
+    normalized = " ".join(user_input.split()).lower()
+    return hashlib.sha256(f"{MODEL_ID}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        if key not in _extraction_cache:
+            return False, None
+        _extraction_cache.move_to_end(key)
+        return True, _extraction_cache[key]
+
+
+def _cache_put(key, location):
+    with _cache_lock:
+        _extraction_cache[key] = location
+        _extraction_cache.move_to_end(key)
+        while len(_extraction_cache) > EXTRACTION_CACHE_SIZE:
+            _extraction_cache.popitem(last=False)
 
+
+# ----------------------------
+# Location Extraction
+# ----------------------------
+def _invoke(prompt: str, max_tokens: int):
     response = bedrock.invoke_model(
-        # modelId="anthropic.claude-haiku-4-5-20251001-v1:0",
-        modelId="anthropic.claude-3-haiku-20240307-v1:0",
-        # inferenceProfileArn="arn:aws:bedrock:us-west-2:501174417548:inference-profile/global.anthropic.claude-haiku-4-5-20251001-v1:0",
+        modelId=MODEL_ID,
         contentType="application/json",
         accept="application/json",
         body=json.dumps({
@@ -36,25 +67,70 @@ def parse_ride_request(user_input: str):
             "messages": [
                 {"role": "user", "content": prompt}
             ],
-            "max_tokens": 100
+            "max_tokens": max_tokens
         })
     )
+    model_response = json.loads(response["body"].read())
+    return model_response["content"][0]["text"]
+
+
+def extract_locations(user_inputs):
+    """
+    Uses Amazon Bedrock to extract one location from each natural language
+    request. Uncached inputs are resolved together in a single model call.
+    Returns a list of location strings (or None) in input order.
+    """
+    keys = [_cache_key(text) for text in user_inputs]
+    results = [None] * len(user_inputs)
+    pending = {}  # cache key -> input text, deduplicated
+    for i, (key, text) in enumerate(zip(keys, user_inputs)):
+        found, location = _cache_get(key)
+        if found:
+            results[i] = location
+        elif not text or not text.strip():
+            results[i] = None
+        else:
+            pending.setdefault(key, text)
+
+    if pending:
+        numbered = "\n".join(f'{n}. "{text}"' for n, text in enumerate(pending.values(), 1))
+        prompt = f"""
+    You're a smart ride assistant helping students around the University of Washington campus.
+    Extract the location from each of these casual ride requests.
+    Return a JSON object with one key: "locations", a list with one entry per request, in order.
+    If a location is missing or unclear, use null for that entry.
+    Requests:
+    {numbered}
+    """
+        try:
+            parsed = json.loads(_invoke(prompt, max_tokens=60 * len(pending) + 40))
+            locations = parsed["locations"]
+            if len(locations) != len(pending):
+                raise ValueError("location count does not match request count")
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            # fallback if parsing fails; not cached so a retry can succeed
+            locations = None
+
+        resolved = {}
+        for n, key in enumerate(pending):
+            resolved[key] = locations[n] if locations is not None else None
+            if locations is not None:
+                _cache_put(key, resolved[key])
+        for i, key in enumerate(keys):
+            if key in resolved:
+                results[i] = resolved[key]
 
-    chunks = []
-    for event in response["body"]:
-        # event is a bytes object, so decode it directly
-        decoded = event.decode("utf-8")
-        chunks.append(decoded)
+    return results
 
-    full_response = "".join(chunks)
-    model_response = json.loads(full_response)
 
-    # Claude models return the response under 'body', read it
-    # model_response = json.loads(response["body"].read())
-    text = model_response["content"][0]["text"]
+def parse_pickup_and_destination(pickup_text: str, destination_text: str):
+    """Resolve both ends of a ride in one model call"""
+    pickup, destination = extract_locations([pickup_text, destination_text])
+    return pickup, destination
 
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # fallback if parsing fails
-        return {"location": None}
+
+def parse_ride_request(user_input: str):
+    """
+    Uses Amazon Bedrock to extract location info from a natural language request.
+    """
+    return {"location": extract_locations([user_input])[0]}
@@ -0,0 +1,79 @@
+"""
+Solve-time benchmark for the batch assignment engine.
+
+    python bench_assignment.py [--sizes 50 200 1000] [--repeat 3]
+
+Drivers and rides are placed uniformly at random inside the campus bounds;
+drivers = rides / 2 to mimic a busy night. No AWS calls are made.
+"""
+import argparse
+import datetime
+import time
+import numpy as np
+from assignment import build_cost_matrix, hungarian, greedy
+from travel_matrix import CAMPUS_BOUNDS
+
+
+def random_points(rng, n):
+    b = CAMPUS_BOUNDS
+    lats = rng.uniform(b["lat_min"], b["lat_max"], n)
+    lons = rng.uniform(b["lon_min"], b["lon_max"], n)
+    return [{"lat": lat, "lon": lon} for lat, lon in zip(lats, lons)]
+
+
+def make_fleet(rng, n_rides):
+    now = datetime.datetime.utcnow()
+    drivers = [dict(p, driver_id=f"d{i}") for i, p in enumerate(random_points(rng, max(1, n_rides // 2)))]
+    rides = [
+        {
+            "ride_id": f"r{i}",
+            "pickup": p,
+            "timestamp": (now - datetime.timedelta(seconds=float(rng.uniform(0, 900)))).isoformat(),
+        }
+        for i, p in enumerate(random_points(rng, n_rides))
+    ]
+    return drivers, rides, now
+
+
+def fifo_cost(cost):
+    """Total cost of the old behaviour: driver i takes ride i in queue order"""
+    n = min(cost.shape)
+    return float(cost[np.arange(n), np.arange(n)].sum())
+
+
+def timed(func, *args, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'rides':>6} {'drivers':>8} {'cost matrix':>12} {'hungarian':>10} {'greedy':>10} "
+          f"{'fifo pickup s':>14} {'hungarian s':>12} {'greedy s':>10}")
+    for n_rides in args.sizes:
+        drivers, rides, now = make_fleet(rng, n_rides)
+        t_cost, cost = timed(build_cost_matrix, drivers, rides, now, repeat=args.repeat)
+        pickup = build_cost_matrix(drivers, rides, now, wait_weight=0)
+
+        t_hung, cols = timed(hungarian, cost, repeat=args.repeat)
+        t_greedy, pairs = timed(greedy, cost, repeat=args.repeat)
+        hung_pickup = float(pickup[np.arange(len(cols)), cols].sum())
+        greedy_pickup = float(sum(pickup[r, c] for r, c in pairs))
+
+        print(f"{n_rides:>6} {len(drivers):>8} {t_cost * 1000:>10.1f}ms {t_hung * 1000:>8.1f}ms "
+              f"{t_greedy * 1000:>8.1f}ms {fifo_cost(pickup):>14.0f} {hung_pickup:>12.0f} {greedy_pickup:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
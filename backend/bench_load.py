@@ -0,0 +1,322 @@
+"""
+Offline load test: the FastAPI app driven in-process against in-memory
+stand-ins for DynamoDB, Amazon Location and Bedrock (fake_aws.py).
+
+    python bench_load.py [--drivers 20] [--students 100] [--duration 30]
+                         [--ws-fraction 0.5] [--aws-ms 8] [--aws-tail-ms 4]
+
+Drivers ping /update_driver_location and refresh their dashboard
+(/driver_view, or /driver_heartbeat with --heartbeat), accept the first
+waiting ride and complete it after --trip-seconds. Students resolve their
+request text through POST /parse_ride_request (Bedrock), POST
+/request_ride, then either poll /client_status or hold /ws/ride until the
+ride completes.
+
+Reports throughput and p50/p95/p99 latency per endpoint, the delay from a
+driver's accept to the rider's WebSocket update, and the AWS calls made.
+
+Needs httpx, a dev-only dependency not in requirements.txt:
+
+    pip install httpx==0.28.1
+"""
+import argparse
+import os
+
+# Keep every cache in memory and off disk, and quiet the app's logging;
+# set before the app modules read their configuration at import
+os.environ.update({
+    "GEOCODE_CACHE_PATH": ":memory:",
+    "ROUTE_CACHE_PATH": "",
+    "TRAVEL_MATRIX_PATH": "",
+    "RIDE_BUS": "local",
+    "AUTO_ASSIGN": "false",
+    "LOG_LEVEL": "WARNING",
+})
+os.environ.setdefault("AWS_REGION", "us-west-2")
+
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+import httpx
+import numpy as np
+import fake_aws
+import db
+import storage
+import main as backend
+from geocode_cache import CAMPUS_LOCATIONS
+from travel_matrix import CAMPUS_BOUNDS
+from ws_hub import hub
+from route_tracker import route_tracker
+
+
+# ----------------------------
+# Measurements
+# ----------------------------
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok=True):
+        self.samples[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def report(self, elapsed):
+        print(f"{'endpoint':<28} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name in sorted(self.samples):
+            samples = np.array(self.samples[name]) * 1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            print(f"{name:<28} {len(samples):>7} {len(samples) / elapsed:>8.1f} "
+                  f"{p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {self.errors[name]:>7}")
+
+
+async def call(client, recorder, name, method, url, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except Exception:
+        recorder.record(name, time.perf_counter() - start, ok=False)
+        return None
+    recorder.record(name, time.perf_counter() - start, ok=response.status_code < 400)
+    return response
+
+
+# ----------------------------
+# In-Process WebSocket Client
+# ----------------------------
+class AsgiWebSocket:
+    """Drives a WebSocket route straight through the ASGI interface (no network)"""
+
+    def __init__(self, app, path):
+        self.to_app = asyncio.Queue()
+        self.from_app = asyncio.Queue()
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": [], "subprotocols": [], "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+        }
+        self.task = asyncio.create_task(app(scope, self.to_app.get, self.from_app.put))
+
+    async def connect(self):
+        await self.to_app.put({"type": "websocket.connect"})
+        message = await self.from_app.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"WebSocket rejected: {message}")
+
+    async def receive_json(self):
+        """Next JSON message, or None once the server closed the socket"""
+        message = await self.from_app.get()
+        if message["type"] == "websocket.close":
+            return None
+        return json.loads(message.get("text") or message["bytes"])
+
+    async def send_text(self, text):
+        await self.to_app.put({"type": "websocket.receive", "text": text})
+
+    async def close(self):
+        await self.to_app.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except Exception:
+            self.task.cancel()
+
+
+# ----------------------------
+# Simulated Users
+# ----------------------------
+class Simulation:
+    def __init__(self, args, client):
+        self.args = args
+        self.client = client
+        self.recorder = Recorder()
+        self.rng = random.Random(args.seed)
+        self.deadline = time.monotonic() + args.duration
+        self.accepted_at = {}  # ride_id -> perf_counter time the accept was sent
+        self.ws_messages = 0
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def random_point(self):
+        b = CAMPUS_BOUNDS
+        return self.rng.uniform(b["lat_min"], b["lat_max"]), self.rng.uniform(b["lon_min"], b["lon_max"])
+
+    async def student(self, n):
+        args = self.args
+        await asyncio.sleep(self.rng.uniform(0, args.ramp))
+        uw_id = f"student{n}"
+        pickup, destination = self.rng.sample(CAMPUS_LOCATIONS, 2)
+
+        response = await call(self.client, self.recorder, "POST /parse_ride_request", "POST", "/parse_ride_request", json={
+            "pickup_text": f"pick me up at {pickup}", "destination_text": f"take me to {destination}",
+        })
+        if response is None:
+            return
+        parsed = response.json()
+        pickup, destination = parsed["pickup"], parsed["destination"]
+        if not (pickup and destination):
+            return
+
+        response = await call(self.client, self.recorder, "POST /request_ride", "POST", "/request_ride", json={
+            "name": uw_id, "uw_id": uw_id, "pickup_address": pickup, "destination_address": destination,
+        })
+        if response is None or "error" in response.json():
+            return
+        if self.rng.random() < args.ws_fraction:
+            await self.hold_websocket(uw_id)
+        else:
+            await self.poll(uw_id)
+
+    async def poll(self, ride_id):
+        while self.remaining() > 0:
+            response = await call(self.client, self.recorder, "GET /client_status", "GET", f"/client_status/{ride_id}")
+            if response is not None and response.json().get("status") == "completed":
+                return
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def hold_websocket(self, ride_id):
+        ws = AsgiWebSocket(backend.app, f"/ws/ride/{ride_id}")
+        start = time.perf_counter()
+        try:
+            await ws.connect()
+            self.recorder.record("WS /ws/ride connect", time.perf_counter() - start)
+            seen_in_car = False
+            while self.remaining() > 0:
+                try:
+                    message = await asyncio.wait_for(ws.receive_json(), self.remaining())
+                except asyncio.TimeoutError:
+                    return
+                if message is None:
+                    return
+                if message.get("type") == "ping":
+                    await ws.send_text("pong")
+                    continue
+                self.ws_messages += 1
+                status = message.get("status")
+                if status == "in_car" and not seen_in_car:
+                    seen_in_car = True
+                    accepted = self.accepted_at.get(ride_id)
+                    if accepted is not None:
+                        self.recorder.record("push accept->rider", time.perf_counter() - accepted)
+                elif status == "completed":
+                    return
+        except ConnectionError:
+            self.recorder.record("WS /ws/ride connect", time.perf_counter() - start, ok=False)
+        finally:
+            await ws.close()
+
+    async def driver(self, n):
+        driver_id = f"driver{n}"
+        state = {"position": self.random_point(), "ride_id": None, "started": None}
+        await self.ping(driver_id, state)
+        await asyncio.gather(self.pinger(driver_id, state), self.dashboard(driver_id, state))
+
+    async def ping(self, driver_id, state):
+        lat, lon = state["position"]
+        state["position"] = (lat + self.rng.uniform(-2e-4, 2e-4), lon + self.rng.uniform(-2e-4, 2e-4))
+        await call(self.client, self.recorder, "POST /update_driver_location", "POST", "/update_driver_location", json={
+            "driver_id": driver_id, "lat": lat, "lon": lon, "current_ride_id": state["ride_id"],
+        })
+
+    async def pinger(self, driver_id, state):
+        while self.remaining() > 0:
+            await asyncio.sleep(self.args.ping_interval * self.rng.uniform(0.9, 1.1))
+            await self.ping(driver_id, state)
+
+    async def dashboard(self, driver_id, state):
+        args = self.args
+        queue, queue_version, etag = [], None, None
+        while self.remaining() > 0:
+            await asyncio.sleep(args.view_interval * self.rng.uniform(0.9, 1.1))
+            if args.heartbeat:
+                lat, lon = state["position"]
+                headers = {"If-None-Match": etag} if etag else {}
+                response = await call(self.client, self.recorder, "POST /driver_heartbeat", "POST", "/driver_heartbeat",
+                                      headers=headers, json={"driver_id": driver_id, "lat": lat, "lon": lon,
+                                                             "queue_version": queue_version})
+                if response is None or response.status_code == 304:
+                    pass
+                else:
+                    body = response.json()
+                    etag, queue_version = response.headers.get("ETag"), body["queue_version"]
+                    if body["full"]:
+                        queue = body["queue"]
+                    else:
+                        removed = set(body["removed"])
+                        queue = [r for r in queue if r["ride_id"] not in removed] + body["added"]
+            else:
+                response = await call(self.client, self.recorder, "GET /driver_view", "GET", f"/driver_view/{driver_id}")
+                if response is not None:
+                    queue = response.json()["queue"]
+
+            if state["ride_id"] is None and queue:
+                ride_id = queue[0]["ride_id"]
+                self.accepted_at[ride_id] = time.perf_counter()
+                response = await call(self.client, self.recorder, "POST /accept_ride", "POST",
+                                      f"/accept_ride/{driver_id}/{ride_id}")
+                if response is not None and "error" not in response.json():
+                    state["ride_id"], state["started"] = ride_id, time.monotonic()
+                else:
+                    self.accepted_at.pop(ride_id, None)
+            elif state["ride_id"] is not None and time.monotonic() - state["started"] >= args.trip_seconds:
+                await call(self.client, self.recorder, "POST /complete_ride", "POST", f"/complete_ride/{state['ride_id']}")
+                state["ride_id"] = None
+
+
+async def run(args):
+    latency = fake_aws.Latency(args.aws_ms, args.aws_tail_ms, seed=args.seed)
+    fakes = fake_aws.install(latency)
+    if args.storage == "memory":
+        db.store = storage.MemoryStore()
+    elif args.storage == "sqlite":
+        db.store = storage.SqliteStore(args.sqlite_path)
+    transport = httpx.ASGITransport(app=backend.app)
+    async with backend.app.router.lifespan_context(backend.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            sim = Simulation(args, client)
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(sim.driver(n) for n in range(args.drivers)),
+                *(sim.student(n) for n in range(args.students)),
+            )
+            elapsed = time.perf_counter() - start
+            ws_stats = hub.metrics()
+
+    print(f"{args.drivers} drivers, {args.students} students ({args.ws_fraction:.0%} on WebSockets), "
+          f"{elapsed:.1f}s, {args.storage} storage, injected AWS latency {args.aws_ms:g}ms + exp({args.aws_tail_ms:g}ms)\n")
+    sim.recorder.report(elapsed)
+    print("\nAWS calls:")
+    for name, fake in (("dynamodb:Rides", fakes.rides_table), ("dynamodb:Drivers", fakes.drivers_table),
+                       ("dynamodb", fakes.dynamodb), ("location", fakes.location_client), ("bedrock", fakes.bedrock)):
+        for operation, count in sorted(fake.calls.items()):
+            print(f"  {name + ' ' + operation:<40} {count:>7} {count / elapsed:>8.1f}/s")
+    print(f"\nIn-car ETAs: {route_tracker.stats()}")
+    print(f"\nWebSocket messages delivered: {sim.ws_messages}, hub at end: {ws_stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of simulated traffic")
+    parser.add_argument("--ramp", type=float, default=5, help="students arrive over this many seconds")
+    parser.add_argument("--ws-fraction", type=float, default=0.5, help="share of students holding a WebSocket")
+    parser.add_argument("--heartbeat", action="store_true", help="drivers use /driver_heartbeat instead of /driver_view")
+    parser.add_argument("--ping-interval", type=float, default=5, help="driver location ping period (s)")
+    parser.add_argument("--view-interval", type=float, default=3, help="driver dashboard refresh period (s)")
+    parser.add_argument("--poll-interval", type=float, default=3, help="student status poll period (s)")
+    parser.add_argument("--trip-seconds", type=float, default=8, help="time from accept to complete")
+    parser.add_argument("--aws-ms", type=float, default=8, help="base injected latency per AWS call")
+    parser.add_argument("--aws-tail-ms", type=float, default=4, help="mean of the exponential latency tail")
+    parser.add_argument("--storage", choices=["dynamodb", "memory", "sqlite"], default="dynamodb",
+                        help="dynamodb = the DynamoDB code path against the in-memory fakes")
+    parser.add_argument("--sqlite-path", default=":memory:", help="database file for --storage sqlite")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
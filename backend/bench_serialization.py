@@ -0,0 +1,96 @@
+"""
+Serialization cost of a driver_view response with a long waiting queue.
+
+    python bench_serialization.py [--rides 100 500 2000] [--repeat 200]
+
+"before" is the old path: raw storage items with Decimal coordinates run
+through FastAPI's jsonable_encoder and the stdlib-json JSONResponse.
+"after" is Ride records (Decimals converted once, when read from storage)
+rendered by ORJSONResponse directly. The one-off conversion is timed
+separately. No AWS calls are made.
+"""
+import argparse
+import datetime
+import json
+import time
+from decimal import Decimal
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from records import Ride
+from travel_matrix import CAMPUS_BOUNDS
+
+
+def random_place(rng, n):
+    b = CAMPUS_BOUNDS
+    lat = rng.uniform(b["lat_min"], b["lat_max"])
+    lon = rng.uniform(b["lon_min"], b["lon_max"])
+    # Stored the way db.create_ride writes them
+    return {"lat": Decimal(str(lat)), "lon": Decimal(str(lon)), "address": f"{n} NE Campus Pkwy, Seattle, WA 98105"}
+
+
+def make_queue(rng, n_rides):
+    now = datetime.datetime.utcnow()
+    return [
+        {
+            "ride_id": f"netid{i}",
+            "name": f"Student {i}",
+            "pickup": random_place(rng, i),
+            "destination": random_place(rng, i + n_rides),
+            "status": "waiting",
+            "notes": "",
+            "timestamp": (now - datetime.timedelta(seconds=float(rng.uniform(0, 900)))).isoformat(),
+        }
+        for i in range(n_rides)
+    ]
+
+
+def view(queue):
+    return {"current_ride": None, "active_rides": [], "route_stops": [], "queue": queue}
+
+
+def before(items):
+    return JSONResponse(jsonable_encoder(view(items))).body
+
+
+def after(rides):
+    return ORJSONResponse(view(rides)).body
+
+
+def timed(func, *args, repeat=200):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rides", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'rides':>6} {'before':>10} {'after':>10} {'speedup':>8} {'records':>10} {'bytes before':>13} {'bytes after':>12}")
+    for n_rides in args.rides:
+        items = make_queue(rng, n_rides)
+        t_records, rides = timed(lambda: [Ride.from_item(item) for item in items], repeat=args.repeat)
+        t_before, body_before = timed(before, items, repeat=args.repeat)
+        t_after, body_after = timed(after, rides, repeat=args.repeat)
+
+        # Same payload apart from the explicit "driver_id": null records carry
+        decoded = json.loads(body_after)
+        for ride in decoded["queue"]:
+            ride.pop("driver_id")
+        assert decoded == json.loads(body_before)
+
+        print(f"{n_rides:>6} {t_before * 1000:>8.2f}ms {t_after * 1000:>8.2f}ms {t_before / t_after:>7.1f}x "
+              f"{t_records * 1000:>8.2f}ms {len(body_before):>13} {len(body_after):>12}")
+
+
+if __name__ == "__main__":
+    main()
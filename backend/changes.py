@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+
+# Change kinds emitted by db.py
+RIDE_CREATED = "ride_created"
+RIDE_ACCEPTED = "ride_accepted"
+RIDE_COMPLETED = "ride_completed"
+RIDE_UPDATED = "ride_updated"
+DRIVER_MOVED = "driver_moved"
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Change Feed
+# ----------------------------
+class ChangeFeed:
+    """
+    Ordered stream of ride / driver changes from the data layer. Every
+    change gets the next monotonic version and is handed to subscribers in
+    version order, on the thread that made the write, so callbacks must be
+    cheap (flag, enqueue, or call_soon_threadsafe onto an event loop).
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.version = 0
+        self._lock = threading.RLock()
+
+    def subscribe(self, callback):
+        """callback(change) for every change from now on"""
+        with self._lock:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def emit(self, kind, **fields):
+        with self._lock:
+            self.version += 1
+            change = dict(fields, kind=kind, version=self.version, at=time.time())
+            for callback in list(self.subscribers):
+                try:
+                    callback(change)
+                except Exception:
+                    logger.exception("Change subscriber error", extra={"kind": kind})
+        return change
+
+
+change_feed = ChangeFeed()
@@ -1,13 +1,36 @@
 import streamlit as st
 import requests
 import time
-import bedrock as br
+import json
 from geopy.geocoders import Nominatim, Photon
 import db
 
 API_URL = "http://10.18.189.186:5001"
 WS_URL = "ws://10.18.189.186:5001"
 
+# Longest we hold one push stream open before re-rendering anyway
+PUSH_WAIT_SECONDS = 60
+
+
+def wait_for_status_change(ride_id, current_status):
+    """
+    Block on the server's push stream until this ride's status differs from
+    what is on screen. Returns the new status, or None on timeout / error.
+    """
+    deadline = time.time() + PUSH_WAIT_SECONDS
+    try:
+        with requests.get(f"{API_URL}/sse/ride/{ride_id}", stream=True, timeout=(5, 30)) as res:
+            for line in res.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    event = json.loads(line[len("data: "):])
+                    if event.get("type") != "ping" and event != current_status:
+                        return event
+                if time.time() > deadline:
+                    return None
+    except requests.RequestException:
+        time.sleep(2)
+    return None
+
 st.set_page_config(page_title="Campus Escort", layout="centered")
 st.markdown("""
     <style>
@@ -32,6 +55,7 @@ if "ride_requested" not in st.session_state:
     st.session_state.notes = ""
     st.session_state.rideID = ""
     st.session_state.status_data = {}
+    st.session_state.pushed_status = None
 
 if not st.session_state.ride_requested:
     st.subheader("Enter Your Details")
@@ -64,10 +88,13 @@ if not st.session_state.ride_requested:
     #     st.session_state.confirmed = True
     
     if st.session_state.confirmed:
-        user_pickup = br.parse_ride_request(pickup_text)
-        user_destination = br.parse_ride_request(destination_text)
-        pickup = user_pickup["location"]
-        destination = user_destination["location"]
+        # One cached Bedrock call on the server for both ends; reruns reuse the cached result
+        res = requests.post(f"{API_URL}/parse_ride_request", json={
+            "pickup_text": pickup_text,
+            "destination_text": destination_text
+        })
+        parsed = res.json() if res.ok else {}
+        pickup, destination = parsed.get("pickup"), parsed.get("destination")
 
         pickup_address = pickup
         
@@ -80,7 +107,7 @@ if not st.session_state.ride_requested:
 
         geolocator = Nominatim(user_agent="campus-pickup")
         viewbox = [(47.648546, -122.333540), (47.682512, -122.270640)]
-        if user_destination is not None and user_pickup is not None:
+        if destination is not None and pickup is not None:
             destination_address = str(geolocator.geocode(f"{destination}, Seattle, WA", exactly_one=True, viewbox=viewbox, bounded=True, timeout=10))
             pickup_address = geolocator.geocode(f"{pickup}, Seattle, WA", exactly_one=True, viewbox=viewbox, bounded=True, timeout=10)
 
@@ -121,6 +148,7 @@ if not st.session_state.ride_requested:
                             st.session_state.pickup = str(pickup)
                             st.session_state.notes = notes
                             st.session_state.ride_requested = True
+                            st.session_state.pushed_status = None
                             st.session_state.confirmed = False
                             st.success("✅ Ride requested!")
                             time.sleep(1)
@@ -146,11 +174,13 @@ else:
         st.write(f"**To:** {st.session_state.destination}")
         st.write(f"**Ride ID:** {st.session_state.rideID}")
     
-    # Fetch current status
-    res = requests.get(f"{API_URL}/client_status/{st.session_state.rideID}")
+    # Status pushed by the server with the last event, or fetched once on first load
+    status = st.session_state.get("pushed_status")
+    if status is None:
+        res = requests.get(f"{API_URL}/client_status/{st.session_state.rideID}")
+        status = res.json() if res.ok else None
     
-    if res.ok:
-        status = res.json()
+    if status is not None:
         
         if status.get("error"):
             st.error(f"{status['error']}")
@@ -161,10 +191,10 @@ else:
                 st.write(f"**Queue Position:** {status['queue_position']}")
                 st.write(f"**Estimated Wait:** {status['eta']}")
                 
-                # Auto-refresh every 3 seconds
+                # Re-render only when the server pushes a change
                 placeholder = st.empty()
                 with placeholder.container():
-                    st.info("Refreshing in 5 seconds...")
+                    st.info("Live updates on: this page refreshes when your ride changes")
                 # Cancel ride button
                 # if st.button("Cancel Ride Request"):
                 #     st.session_state.ride_requested = False
@@ -173,7 +203,7 @@ else:
                               
                 #     time.sleep(1)
                 #     st.rerun()                    
-                time.sleep(5)
+                st.session_state.pushed_status = wait_for_status_change(st.session_state.rideID, status)
                 st.rerun()
             
             elif status["status"] == "in_car":
@@ -189,11 +219,11 @@ else:
                 
                 st.write(f"**Driver ID:** {status.get('driver_id', 'N/A')}")
                 
-                # Auto-refresh every 2 seconds for live updates
+                # Driver position / ETA arrive as pushes with each location ping
                 placeholder = st.empty()
                 with placeholder.container():
-                    st.info("Live tracking active... refreshing in 5 seconds")                      
-                time.sleep(5)
+                    st.info("Live tracking active")                      
+                st.session_state.pushed_status = wait_for_status_change(st.session_state.rideID, status)
                 st.rerun()
             
             elif status["status"] == "completed":
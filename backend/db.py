@@ -2,32 +2,62 @@
 from dotenv import load_dotenv
 import os
 import boto3
+from botocore.config import Config
 import datetime
-from uuid import uuid4
 from decimal import Decimal
+import logging
+from route_cache import route_cache
+from geocode_cache import geocode_cache
+from travel_matrix import travel_matrix, estimate_route_seconds
+from location_buffer import start_location_buffer
+from spatial_index import DriverGridIndex
+from assignment import plan_assignments
+from pooling import plan_pools
+from metrics import instrument_boto_client
+from records import Ride, Driver
+from changes import change_feed, RIDE_CREATED, RIDE_ACCEPTED, RIDE_COMPLETED, RIDE_UPDATED, DRIVER_MOVED
+from storage import (
+    STORAGE_BACKEND,
+    RideConflictError,
+    Update,
+    Equals,
+    Exists,
+    Missing,
+    SizeAtMost,
+    create_store
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # ----------------------------
 # AWS Setup
 # ----------------------------
-dynamodb = boto3.resource(
-    "dynamodb",
-    region_name=os.getenv("AWS_REGION", "us-west-2"),
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+# Sized to match the async_db executor so worker threads never wait on a connection
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "32"))
+aws_config = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    retries={"max_attempts": 3, "mode": "standard"}
 )
 
-rides_table = dynamodb.Table(os.getenv("DYNAMO_RIDES_TABLE", "Rides"))
-drivers_table = dynamodb.Table(os.getenv("DYNAMO_DRIVERS_TABLE", "Drivers"))
+# Rides / Drivers storage: DynamoDB, or a local SQLite / in-memory store (STORAGE_BACKEND)
+store = create_store(STORAGE_BACKEND, aws_config)
 
 location_client = boto3.client(
     "location",
     region_name=os.getenv("AWS_REGION", "us-west-2"),
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+    config=aws_config
 )
 
+# Geocode and route calls are the billable ones; count and time them for /metrics
+instrument_boto_client(location_client)
+
+# Nearest available drivers per pickup that assignment and queue ETAs weigh
+CANDIDATE_DRIVERS = int(os.getenv("CANDIDATE_DRIVERS", "8"))
+
 PLACE_INDEX = os.getenv("PLACE_INDEX_NAME", "CampusPlaceIndex")
 ROUTE_CALCULATOR = os.getenv("ROUTE_CALCULATOR_NAME", "CampusRouteCalculator")
 
@@ -35,31 +65,46 @@ ROUTE_CALCULATOR = os.getenv("ROUTE_CALCULATOR_NAME", "CampusRouteCalculator")
 # Geocoding / Reverse Geocoding
 # ----------------------------
 def geocode_address(address_text):
+    cached = geocode_cache.get_address(address_text)
+    if cached is not geocode_cache.MISSING:
+        return cached
+
     try:
         response = location_client.search_place_index_for_text(
             IndexName=PLACE_INDEX,
             Text=f"{address_text.strip()}, Seattle, WA",
             MaxResults=1
         )
+        result = None
         if response["Results"]:
             place = response["Results"][0]["Place"]
             lat, lon = place["Geometry"]["Point"][1], place["Geometry"]["Point"][0]
             label = place["Label"]
-            return {"lat": lat, "lon": lon, "address": label}
+            result = {"lat": lat, "lon": lon, "address": label}
+        # Misses are cached too, so invalid addresses stop costing a round trip
+        geocode_cache.put_address(address_text, result)
+        return result
     except Exception as e:
-        print("Geocoding error:", e)
+        logger.warning("Geocoding error", extra={"address": address_text, "error": str(e)})
     return None
 
 def reverse_geocode(lat, lon):
+    cached = geocode_cache.get_position(lat, lon)
+    if cached is not geocode_cache.MISSING:
+        return cached
+
     try:
         response = location_client.search_place_index_for_position(
             IndexName=PLACE_INDEX,
             Position=[lon, lat]
         )
+        label = None
         if response["Results"]:
-            return response["Results"][0]["Place"]["Label"]
+            label = response["Results"][0]["Place"]["Label"]
+        geocode_cache.put_position(lat, lon, label)
+        return label
     except Exception as e:
-        print("Reverse geocoding error:", e)
+        logger.warning("Reverse geocoding error", extra={"lat": lat, "lon": lon, "error": str(e)})
     return None
 
 # ----------------------------
@@ -84,33 +129,49 @@ def create_ride(name, uw_id, pickup, destination, notes=""):
         "notes": notes,
         "timestamp": datetime.datetime.utcnow().isoformat()
     }
-    rides_table.put_item(Item=ride_item)
-    return ride_item
+    store.put("rides", ride_item)
+    change_feed.emit(RIDE_CREATED, ride_id=ride_id)
+    return Ride.from_item(ride_item)
+
+def iter_rides(limit=None, segments=None):
+    """
+    Yield every ride (up to limit), for admin / analytics reads, one scan
+    page at a time. segments > 1 splits the DynamoDB scan into that many
+    parallel segments (result order is not defined).
+    """
+    for item in store.scan("rides", limit=limit, segments=segments):
+        yield Ride.from_item(item)
 
-def get_all_rides():
-    response = rides_table.scan()
-    return response.get("Items", [])
+def get_rides_by_status(status):
+    """Rides with the given status in FIFO (timestamp) order, via the status index"""
+    return [Ride.from_item(item) for item in store.rides_by_status(status)]
+
+def get_waiting_rides():
+    return get_rides_by_status("waiting")
+
+def create_rides_status_index():
+    """One-time setup: add the status/timestamp GSI to an existing Rides table (DynamoDB only)"""
+    store.create_rides_status_index()
 
 def update_ride_status(ride_id, status, driver_id=None):
-    update_expr = "SET #s = :status"
-    expr_names = {"#s": "status"}
-    expr_values = {":status": status}
+    fields = {"status": status}
     if driver_id:
-        update_expr += ", driver_id = :d"
-        expr_values[":d"] = driver_id
-    rides_table.update_item(
-        Key={"ride_id": ride_id},
-        UpdateExpression=update_expr,
-        ExpressionAttributeNames=expr_names,
-        ExpressionAttributeValues=expr_values
-    )
+        fields["driver_id"] = driver_id
+    store.update("rides", ride_id, fields)
+    kind = {"in_car": RIDE_ACCEPTED, "completed": RIDE_COMPLETED}.get(status, RIDE_UPDATED)
+    change_feed.emit(kind, ride_id=ride_id, status=status, driver_id=driver_id)
 
 def calculate_route_minutes_seconds(pickup, destination):
-    try:
-        print("Calculating route...")
-        print("Pickup:", pickup)
-        print("Destination:", destination)
+    cached = route_cache.get(pickup, destination)
+    if cached is not None:
+        return cached // 60, cached % 60
 
+    # Campus pairs are answered from the precomputed matrix when one is built
+    if travel_matrix is not None and travel_matrix.covers(pickup, destination):
+        eta_seconds = travel_matrix.estimate(pickup, destination)
+        return eta_seconds // 60, eta_seconds % 60
+
+    try:
         response = location_client.calculate_route(
             CalculatorName=ROUTE_CALCULATOR,
             DeparturePosition=[float(pickup["lon"]), float(pickup["lat"])],
@@ -119,78 +180,301 @@ def calculate_route_minutes_seconds(pickup, destination):
             DistanceUnit="Kilometers",
             IncludeLegGeometry=False
         )
-        print("🛰️ Full route response:", response)
+        logger.debug("Route response", extra={"pickup": pickup, "destination": destination, "response": response})
 
         # Check for 'Legs' in response
         if "Legs" in response and response["Legs"]:
             leg = response["Legs"][0]
             eta_seconds = int(leg["DurationSeconds"])
+            route_cache.put(pickup, destination, eta_seconds)
             minutes = eta_seconds // 60
             seconds = eta_seconds % 60
-            print(f"ETA: {minutes} min {seconds} sec")
             return minutes, seconds
         elif "Summary" in response:
             eta_seconds = int(response["Summary"]["DurationSeconds"])
+            route_cache.put(pickup, destination, eta_seconds)
             minutes = eta_seconds // 60
             seconds = eta_seconds % 60
-            print(f"ETA: {minutes} min {seconds} sec")
             return minutes, seconds
         else:
-            print("No route found in response structure.")
+            logger.warning("No route found in response structure", extra={"pickup": pickup, "destination": destination})
     except Exception as e:
-        print("Route calculation error:", e)
-        print("Using fallback estimate: 5 minutes")
-        return 5, 0
+        logger.warning("Route calculation error", extra={"error": str(e)})
+
+    # Fallback if route calculation fails: distance / speed-model estimate
+    eta_seconds = estimate_route_seconds(pickup, destination)
+    logger.info("Using fallback route estimate", extra={"eta_seconds": eta_seconds})
+    return eta_seconds // 60, eta_seconds % 60
 
-    return 5, 0  # Fallback if route calculation fails
+def calculate_route_geometry(origin, destination, waypoints=()):
+    """
+    Route (through any waypoints, in order) with its polyline and per-step
+    durations, for projecting in-car ETAs locally (see route_tracker.py).
+    Returns {"line": [[lon, lat], ...], "steps": [...], "duration_seconds",
+    "leg_ends": [vertex index where each leg ends]} or None if the route
+    call fails.
+    """
+    try:
+        kwargs = {}
+        if waypoints:
+            kwargs["WaypointPositions"] = [[float(w["lon"]), float(w["lat"])] for w in waypoints]
+        response = location_client.calculate_route(
+            CalculatorName=ROUTE_CALCULATOR,
+            DeparturePosition=[float(origin["lon"]), float(origin["lat"])],
+            DestinationPosition=[float(destination["lon"]), float(destination["lat"])],
+            TravelMode="Car",
+            DistanceUnit="Kilometers",
+            IncludeLegGeometry=True,
+            **kwargs
+        )
+        # Legs share their end / start vertex; step offsets are per leg
+        line, steps, leg_ends = [], [], []
+        for leg in response["Legs"]:
+            offset = max(len(line) - 1, 0)
+            steps.extend(dict(s, GeometryOffset=s["GeometryOffset"] + offset) if "GeometryOffset" in s else s
+                         for s in leg.get("Steps", []))
+            points = leg["Geometry"]["LineString"]
+            line.extend(points[1:] if line else points)
+            leg_ends.append(len(line) - 1)
+        if any(not leg.get("Steps") for leg in response["Legs"]):
+            steps = []  # partial step data: spread the duration over the whole line instead
+        return {
+            "line": line,
+            "steps": steps,
+            "duration_seconds": sum(float(leg["DurationSeconds"]) for leg in response["Legs"]),
+            "leg_ends": leg_ends
+        }
+    except Exception as e:
+        logger.warning("Route geometry error", extra={"origin": origin, "destination": destination, "error": str(e)})
+        return None
 
 # ----------------------------
 # Driver Functions
 # ----------------------------
 def update_driver_location(driver_id, lat, lon, available=True, current_ride_id=None):
-    drivers_table.update_item(
-        Key={"driver_id": driver_id},
-        UpdateExpression="SET lat = :lat, lon = :lon, available = :avail, current_ride_id = :ride, last_updated = :ts",
-        ExpressionAttributeValues={
-            ":lat": Decimal(str(lat)),
-            ":lon": Decimal(str(lon)),
-            ":avail": available,
-            ":ride": current_ride_id,
-            ":ts": datetime.datetime.utcnow().isoformat()
-        }
-    )
+    driver_index.upsert(driver_id, lat, lon, available)
+    store.update("drivers", driver_id, {
+        "lat": Decimal(str(lat)),
+        "lon": Decimal(str(lon)),
+        "available": available,
+        "current_ride_id": current_ride_id,
+        "active_ride_ids": [current_ride_id] if current_ride_id else [],
+        "last_updated": datetime.datetime.utcnow().isoformat()
+    })
+    change_feed.emit(DRIVER_MOVED, driver_id=driver_id, lat=lat, lon=lon, available=available,
+                     ride_ids=[current_ride_id] if current_ride_id else [])
+
+def get_active_ride_ids(driver):
+    """Rides a driver is carrying; pooled drivers can have several"""
+    if driver.get("active_ride_ids"):
+        return list(driver["active_ride_ids"])
+    return [driver["current_ride_id"]] if driver.get("current_ride_id") else []
+
+# ----------------------------
+# Ride State Transitions
+# ----------------------------
+def _ride_transition(ride_id, from_status, to_status, driver_id=None, expected_driver_id=None):
+    fields = {"status": to_status}
+    condition = Equals("status", from_status)
+    if driver_id:
+        fields["driver_id"] = driver_id
+    if expected_driver_id:
+        condition = condition & Equals("driver_id", expected_driver_id)
+    return Update("rides", ride_id, fields, condition)
+
+def _driver_rides_update(driver_id, ride_ids, stops, condition):
+    return Update("drivers", driver_id, {
+        "available": not ride_ids,
+        "current_ride_id": ride_ids[0] if ride_ids else None,
+        "active_ride_ids": list(ride_ids),
+        "route_stops": [{"type": s["type"], "ride_id": s["ride_id"]} for s in (stops or [])]
+    }, condition)
+
+def assign_rides_to_driver(driver_id, ride_ids, stops=None):
+    """
+    Atomically move waiting rides into an available driver's car (one or
+    several, with the planned stop order). Raises RideConflictError if any
+    ride is no longer waiting, the driver is busy or the driver does not
+    exist; nothing is written then.
+    """
+    updates = [_ride_transition(ride_id, "waiting", "in_car", driver_id=driver_id) for ride_id in ride_ids]
+    updates.append(_driver_rides_update(
+        driver_id, ride_ids, stops,
+        Exists("driver_id") & (Missing("available") | Equals("available", True))
+    ))
+    reasons = ["Ride not available"] * len(ride_ids) + ["Driver not available"]
+    try:
+        store.transact(updates, reasons)
+    except RideConflictError as e:
+        if e.index != len(ride_ids) or store.get("drivers", driver_id) is not None:
+            raise
+        # A driver whose first pings are still buffered has no stored item yet
+        position = driver_locations.get(driver_id)
+        if position is None:
+            raise RideConflictError("Driver not found", e.index) from e
+        write_driver_position(driver_id, position["lat"], position["lon"], position["last_updated"])
+        store.transact(updates, reasons)
+    driver_index.set_available(driver_id, False)
+    for ride_id in ride_ids:
+        change_feed.emit(RIDE_ACCEPTED, ride_id=ride_id, driver_id=driver_id)
+
+def accept_ride_transaction(driver_id, ride_id):
+    assign_rides_to_driver(driver_id, [ride_id])
+
+def complete_ride_transaction(ride_id):
+    """
+    Mark an in-car ride completed and take it out of the driver's car in one
+    transaction. The driver becomes available once no pooled rides remain.
+    Returns the driver's remaining ride ids.
+    """
+    ride = get_ride_by_id(ride_id)
+    if not ride:
+        raise RideConflictError("Ride not found")
+    driver_id = ride.get("driver_id")
+    if not driver_id:
+        update_ride_status(ride_id, "completed")
+        return []
 
-def get_all_drivers():
-    response = drivers_table.scan()
-    return response.get("Items", [])
+    reasons = ["Ride is not in progress", "Driver changed concurrently, try again"]
+    ride_item = _ride_transition(ride_id, "in_car", "completed", expected_driver_id=driver_id)
+    try:
+        # Common case: this is the driver's only ride, so no driver read is needed
+        store.transact([ride_item, _driver_rides_update(
+            driver_id, [], [],
+            Equals("current_ride_id", ride_id) & (Missing("active_ride_ids") | SizeAtMost("active_ride_ids", 1))
+        )], reasons)
+        driver_index.set_available(driver_id, True)
+        change_feed.emit(RIDE_COMPLETED, ride_id=ride_id, driver_id=driver_id, remaining=[])
+        return []
+    except RideConflictError as e:
+        if e.index != 1:
+            raise
+
+    # Pooled car: drop just this ride, guarded against concurrent changes
+    driver = get_driver_by_id(driver_id) or {"driver_id": driver_id}
+    remaining = [r for r in get_active_ride_ids(driver) if r != ride_id]
+    stops = [s for s in driver.get("route_stops", []) if s.get("ride_id") != ride_id]
+    if "active_ride_ids" in driver:
+        condition = Equals("active_ride_ids", driver["active_ride_ids"])
+    else:
+        condition = Missing("active_ride_ids")
+    store.transact([ride_item, _driver_rides_update(driver_id, remaining, stops, condition)], reasons)
+    driver_index.set_available(driver_id, not remaining)
+    change_feed.emit(RIDE_COMPLETED, ride_id=ride_id, driver_id=driver_id, remaining=remaining)
+    return remaining
+
+def write_driver_position(driver_id, lat, lon, last_updated):
+    """Position-only write used by the location buffer; leaves assignment fields alone"""
+    store.update("drivers", driver_id, {
+        "lat": Decimal(str(lat)),
+        "lon": Decimal(str(lon)),
+        "last_updated": last_updated
+    })
+
+# Driver pings are buffered in memory and written behind in coalesced batches
+driver_locations = start_location_buffer(write_driver_position)
+
+def record_driver_ping(driver_id, lat, lon, ride_ids=()):
+    """Acknowledge a driver position ping without waiting on storage; ride_ids are the rides in the car"""
+    driver_locations.update(driver_id, lat, lon)
+    # A driver's first ping adds them to the pool the queue is drained by
+    joined = driver_index.upsert(driver_id, lat, lon)
+    change_feed.emit(DRIVER_MOVED, driver_id=driver_id, lat=lat, lon=lon, ride_ids=list(ride_ids), joined=joined)
+
+def iter_drivers():
+    """Yield every driver with its latest buffered position, one scan page at a time"""
+    known = set()
+    for driver in store.scan("drivers"):
+        known.add(driver["driver_id"])
+        yield Driver.from_item(driver_locations.overlay(driver))
+    # Drivers who have pinged but not been flushed yet
+    for driver_id, position in driver_locations.snapshot().items():
+        if driver_id not in known:
+            yield Driver.from_item(dict(position, driver_id=driver_id))
+
+# Live driver positions for proximity queries; seeded from a scan, then kept
+# current by pings and state changes
+driver_index = DriverGridIndex(loader=iter_drivers)
+
+def get_available_drivers():
+    """Available drivers from the spatial index (no table scan)"""
+    return driver_index.available()
+
+def get_candidate_drivers(points, k=CANDIDATE_DRIVERS):
+    """
+    Available drivers among the k nearest (by the spatial index) to any of
+    the points, so travel-time matrices skip drivers no pickup would pick
+    """
+    drivers = driver_index.available()
+    if len(drivers) <= k:
+        return drivers
+    candidates = {}
+    for point in points:
+        for _, driver in driver_index.nearest(point["lat"], point["lon"], k=k):
+            candidates.setdefault(driver["driver_id"], driver)
+    return list(candidates.values())
+
+def get_nearest_available_drivers(lat, lon, k=1, max_meters=None):
+    """Up to k available drivers closest to (lat, lon), as (meters, driver) pairs"""
+    return driver_index.nearest(lat, lon, k=k, max_meters=max_meters)
+
+def get_available_drivers_within(lat, lon, meters):
+    return driver_index.within_radius(lat, lon, meters)
 
 # ----------------------------
 # Ride Assignment
 # ----------------------------
 def assign_next_ride():
-    rides = [r for r in get_all_rides() if r["status"] == "waiting"]
-    drivers = [d for d in get_all_drivers() if d.get("available", True)]
-    
-    for ride in rides:
-        if drivers:
-            driver = drivers.pop(0)
-            update_ride_status(ride["ride_id"], "in_car", driver["driver_id"])
-            update_driver_location(driver["driver_id"], driver["lat"], driver["lon"], available=False, current_ride_id=ride["ride_id"])
+    """
+    Batch-assign waiting rides to available drivers with a min-cost matching
+    over estimated pickup times. Returns the [(ride_id, driver_id)] made.
+    """
+    rides = get_waiting_rides()
+    drivers = get_candidate_drivers([ride["pickup"] for ride in rides])
+    made = []
+    for driver, ride in plan_assignments(drivers, rides):
+        try:
+            assign_rides_to_driver(driver["driver_id"], [ride["ride_id"]])
+        except RideConflictError as e:
+            logger.info("Skipping assignment", extra={"ride_id": ride["ride_id"], "error": str(e)})
+            continue
+        made.append((ride["ride_id"], driver["driver_id"]))
+    return made
+
+def assign_pools():
+    """
+    Pooling mode: group compatible waiting rides into shared multi-stop
+    trips and hand each trip to the nearest available driver.
+    Returns the [(ride_id, driver_id)] made.
+    """
+    made = []
+    for plan in plan_pools(get_available_drivers(), get_waiting_rides()):
+        driver_id = plan["driver"]["driver_id"]
+        ride_ids = [r["ride_id"] for r in plan["rides"]]
+        try:
+            assign_rides_to_driver(driver_id, ride_ids, plan["stops"])
+        except RideConflictError as e:
+            logger.info("Skipping pooled trip", extra={"driver_id": driver_id, "error": str(e)})
+            continue
+        made.extend((ride_id, driver_id) for ride_id in ride_ids)
+    return made
 
 def get_ride_by_id(ride_id):
-    """Fetch a specific ride from DynamoDB"""
+    """Fetch a specific ride from storage"""
     try:
-        response = rides_table.get_item(Key={"ride_id": ride_id})
-        return response.get("Item")
+        return Ride.from_item(store.get("rides", ride_id))
     except Exception as e:
-        print(f"Error fetching ride {ride_id}: {e}")
+        logger.error("Error fetching ride", extra={"ride_id": ride_id, "error": str(e)})
         return None
 
 def get_driver_by_id(driver_id):
-    """Fetch a specific driver from DynamoDB"""
+    """Fetch a specific driver from storage"""
     try:
-        response = drivers_table.get_item(Key={"driver_id": driver_id})
-        return response.get("Item")
+        driver = store.get("drivers", driver_id)
+        if driver is None:
+            position = driver_locations.get(driver_id)
+            return Driver.from_item(dict(position, driver_id=driver_id)) if position else None
+        return Driver.from_item(driver_locations.overlay(driver))
     except Exception as e:
-        print(f"Error fetching driver {driver_id}: {e}")
+        logger.error("Error fetching driver", extra={"driver_id": driver_id, "error": str(e)})
         return None
\ No newline at end of file
@@ -222,31 +222,43 @@ if st.session_state.checked_in:
     st.subheader("Your Location")
     lat, lon = get_browser_location()
     
-    # Send location update to backend every 5 seconds
-    current_time = time.time()
-    if current_time - st.session_state.last_location_update > 5:
-        try:
-            # Get current ride ID if driver has one
-            res_view = requests.get(f"{API_URL}/driver_view/{driver_id}")
-            current_ride_id = None
-            if res_view.ok:
-                data = res_view.json()
-                if data.get("current_ride"):
-                    current_ride_id = data["current_ride"]["ride_id"]
-            
-            # Send location update
-            res = requests.post(f"{API_URL}/update_driver_location", json={
-                "driver_id": driver_id,
-                "lat": lat,
-                "lon": lon,
-                "current_ride_id": current_ride_id
-            })
+    # One heartbeat per refresh: sends our position and gets back only what
+    # changed in the queue / our assignment since the last one
+    if "queue_version" not in st.session_state:
+        st.session_state.queue_version = None
+        st.session_state.etag = None
+        st.session_state.dashboard = None
+    try:
+        headers = {"If-None-Match": st.session_state.etag} if st.session_state.etag else {}
+        res = requests.post(f"{API_URL}/driver_heartbeat", json={
+            "driver_id": driver_id,
+            "lat": lat,
+            "lon": lon,
+            "queue_version": st.session_state.queue_version
+        }, headers=headers)
+        
+        if res.status_code == 200:
+            beat = res.json()
+            if beat["full"] or st.session_state.dashboard is None:
+                queue = beat["queue"] if beat["full"] else []
+            else:
+                removed = set(beat["removed"])
+                queue = [r for r in st.session_state.dashboard["queue"] if r["ride_id"] not in removed]
+                queue = sorted(queue + beat["added"], key=lambda r: r.get("timestamp", ""))
+            st.session_state.dashboard = {
+                "current_ride": beat["current_ride"],
+                "active_rides": beat["active_rides"],
+                "route_stops": beat["route_stops"],
+                "queue": queue
+            }
+            st.session_state.queue_version = beat["queue_version"]
+            st.session_state.etag = res.headers.get("ETag")
+            st.session_state.last_location_update = time.time()
+        elif res.status_code == 304:
+            st.session_state.last_location_update = time.time()
             
-            if res.ok:
-                st.session_state.last_location_update = current_time
-                
-        except Exception as e:
-            st.warning(f"Failed to update location: {e}")
+    except Exception as e:
+        st.warning(f"Failed to update location: {e}")
     
     # Main dashboard
     col1, col2 = st.columns([2, 1])
@@ -256,9 +268,8 @@ if st.session_state.checked_in:
         if st.button("Refresh Queue"):
             st.rerun()
         
-        res = requests.get(f"{API_URL}/driver_view/{driver_id}")
-        if res.ok:
-            data = res.json()
+        data = st.session_state.dashboard
+        if data is not None:
             
             # Current ride section
             if data["current_ride"]:
@@ -272,13 +283,34 @@ if st.session_state.checked_in:
                     st.write(f"**To:** {ride['destination']['address']}")
                     st.write(f"**Notes:** {ride.get('notes', 'N/A')}")
                 
+                # Pooled trip: show every rider in the car and the planned stop order
+                active_rides = data.get("active_rides", [])
+                if len(active_rides) > 1:
+                    names = {r["ride_id"]: r["name"] for r in active_rides}
+                    st.write(f"**Shared ride:** {len(active_rides)} passengers")
+                    for n, stop in enumerate(data.get("route_stops", []), 1):
+                        verb = "Pick up" if stop["type"] == "pickup" else "Drop off"
+                        st.caption(f"{n}. {verb} {names.get(stop['ride_id'], stop['ride_id'])}")
+                
                 st.info("Your live location is being sent to the passenger automatically")
                 
-                if st.button("Complete Ride"):
-                    res = requests.post(f"{API_URL}/complete_ride/{ride['ride_id']}")
+                # Complete whoever the planned route drops off next, not always the first rider
+                active_ids = [r["ride_id"] for r in active_rides] or [ride["ride_id"]]
+                next_dropoff = next(
+                    (s["ride_id"] for s in data.get("route_stops", [])
+                     if s["type"] == "dropoff" and s["ride_id"] in active_ids),
+                    active_ids[0]
+                )
+                label = "Complete Ride"
+                if len(active_ids) > 1:
+                    dropoff_name = next((r["name"] for r in active_rides if r["ride_id"] == next_dropoff), next_dropoff)
+                    label = f"Complete Ride: drop off {dropoff_name}"
+                if st.button(label, key=f"complete_{next_dropoff}"):
+                    res = requests.post(f"{API_URL}/complete_ride/{next_dropoff}")
                     if res.ok:
                         st.success("Ride completed!")
                         st.session_state.current_ride = None
+                        st.session_state.etag = None
                         time.sleep(1)
                         st.rerun()
             else:
@@ -302,6 +334,7 @@ if st.session_state.checked_in:
                                 )
                                 if res.ok:
                                     st.success("Ride accepted!")
+                                    st.session_state.etag = None
                                     time.sleep(1)
                                     st.rerun()
                         st.divider()
@@ -0,0 +1,417 @@
+"""
+In-memory stand-ins for the AWS clients used by storage.py, db.py and
+bedrock.py, so the backend can be exercised offline (see bench_load.py).
+
+Only the calls and expression forms this codebase uses are supported:
+SET/REMOVE update expressions, comparison / AND / OR / NOT / size() /
+attribute_(not_)exists conditions, status-index queries, paginated and
+segmented scans, TransactWriteItems with cancellation reasons, and the
+Location / Bedrock calls made by the app. Every call sleeps for an
+injected latency first.
+"""
+import copy
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+from travel_matrix import CAMPUS_BOUNDS, estimate_seconds, haversine_meters
+
+
+# ----------------------------
+# Latency Injection
+# ----------------------------
+class Latency:
+    """Base delay plus an exponential tail, in milliseconds"""
+
+    def __init__(self, base_ms=0.0, tail_ms=0.0, seed=None):
+        self.base = base_ms / 1000
+        self.tail = tail_ms / 1000
+        self._random = random.Random(seed)
+
+    def wait(self):
+        delay = self.base + (self._random.expovariate(1 / self.tail) if self.tail else 0.0)
+        if delay:
+            time.sleep(delay)
+
+
+NO_LATENCY = Latency()
+
+
+class CallCounter(dict):
+    """Calls per operation; safe to bump from executor threads"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def add(self, operation):
+        with self._lock:
+            self[operation] = self.get(operation, 0) + 1
+
+
+def _client_error(code, operation, message="", **extra):
+    return ClientError(dict({"Error": {"Code": code, "Message": message}}, **extra), operation)
+
+
+# ----------------------------
+# Expressions
+# ----------------------------
+_TOKEN = re.compile(r"\s*(<=|>=|<>|[=<>(),]|[#:]?[A-Za-z_][\w.]*)")
+_MISSING = object()
+
+
+def _tokenize(expr):
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = _TOKEN.match(expr, pos)
+        if not match:
+            raise ValueError(f"Unsupported expression near {expr[pos:]!r}")
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+
+class _Condition:
+    """Recursive-descent evaluator for DynamoDB condition expressions"""
+
+    def __init__(self, expr, names, values):
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def evaluate(self, item):
+        self.item = item
+        self.pos = 0
+        result = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Trailing tokens in condition: {self.tokens[self.pos:]}")
+        return result
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self, expected=None):
+        token = self._peek()
+        if expected is not None and (token or "").upper() != expected:
+            raise ValueError(f"Expected {expected}, got {token!r}")
+        self.pos += 1
+        return token
+
+    def _or(self):
+        result = self._and()
+        while (self._peek() or "").upper() == "OR":
+            self._take()
+            rhs = self._and()
+            result = result or rhs
+        return result
+
+    def _and(self):
+        result = self._not()
+        while (self._peek() or "").upper() == "AND":
+            self._take()
+            rhs = self._not()
+            result = result and rhs
+        return result
+
+    def _not(self):
+        if (self._peek() or "").upper() == "NOT":
+            self._take()
+            return not self._not()
+        if self._peek() == "(":
+            self._take()
+            result = self._or()
+            self._take(")")
+            return result
+        token = self._peek()
+        if token in ("attribute_exists", "attribute_not_exists"):
+            self._take()
+            self._take("(")
+            value = self._path_value(self._take())
+            self._take(")")
+            return (value is not _MISSING) == (token == "attribute_exists")
+        lhs = self._operand()
+        op = self._take()
+        rhs = self._operand()
+        if lhs is _MISSING or rhs is _MISSING:
+            return op == "<>"
+        return {
+            "=": lambda a, b: a == b,
+            "<>": lambda a, b: a != b,
+            "<": lambda a, b: a < b,
+            "<=": lambda a, b: a <= b,
+            ">": lambda a, b: a > b,
+            ">=": lambda a, b: a >= b,
+        }[op](lhs, rhs)
+
+    def _operand(self):
+        token = self._take()
+        if token == "size":
+            self._take("(")
+            value = self._path_value(self._take())
+            self._take(")")
+            return _MISSING if value is _MISSING else len(value)
+        if token.startswith(":"):
+            return self.values[token]
+        return self._path_value(token)
+
+    def _path_value(self, token):
+        return self.item.get(self.names.get(token, token), _MISSING)
+
+
+def _apply_update(item, expr, names, values):
+    """Apply a SET / REMOVE update expression to item in place"""
+    names = names or {}
+    for clause in re.split(r"\b(?=SET\b|REMOVE\b)", expr.strip()):
+        if not clause.strip():
+            continue
+        action, _, body = clause.strip().partition(" ")
+        for part in body.split(","):
+            if action.upper() == "SET":
+                attr, _, placeholder = part.partition("=")
+                item[names.get(attr.strip(), attr.strip())] = copy.deepcopy(values[placeholder.strip()])
+            elif action.upper() == "REMOVE":
+                item.pop(names.get(part.strip(), part.strip()), None)
+            else:
+                raise ValueError(f"Unsupported update action {action!r}")
+
+
+# ----------------------------
+# DynamoDB Table
+# ----------------------------
+class FakeTable:
+    """Thread-safe in-memory table with the boto3 Table methods db.py calls"""
+
+    def __init__(self, name, key, indexes=None, latency=NO_LATENCY):
+        self.name = name
+        self.key = key
+        self.indexes = indexes or {}  # index name -> (hash attr, range attr)
+        self.latency = latency
+        self.items = {}
+        self.lock = threading.RLock()
+        self.calls = CallCounter()
+
+    def _count(self, operation):
+        self.latency.wait()
+        self.calls.add(operation)
+
+    def put_item(self, Item, **kwargs):
+        self._count("PutItem")
+        with self.lock:
+            self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._count("GetItem")
+        with self.lock:
+            item = self.items.get(Key[self.key])
+            return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, **kwargs):
+        self._count("UpdateItem")
+        with self.lock:
+            self.apply_update(Key, UpdateExpression, ExpressionAttributeNames,
+                              ExpressionAttributeValues, ConditionExpression, "UpdateItem")
+        return {}
+
+    def check(self, key, condition, names, values):
+        if not condition:
+            return True
+        item = self.items.get(key[self.key], {})
+        return _Condition(condition, names, values).evaluate(item)
+
+    def apply_update(self, key, update, names, values, condition, operation):
+        if not self.check(key, condition, names, values):
+            raise _client_error("ConditionalCheckFailedException", operation, "The conditional request failed")
+        item = self.items.setdefault(key[self.key], dict(key))
+        _apply_update(item, update, names, values)
+
+    def query(self, IndexName, KeyConditionExpression, ScanIndexForward=True, Limit=None,
+              ExclusiveStartKey=None, **kwargs):
+        self._count("Query")
+        hash_attr, range_attr = self.indexes[IndexName]
+        expression = KeyConditionExpression.get_expression()
+        attr, wanted = expression["values"][0].name, expression["values"][1]
+        if attr != hash_attr or expression["operator"] != "=":
+            raise ValueError("Only hash-key equality queries are supported")
+        with self.lock:
+            matches = [copy.deepcopy(i) for i in self.items.values()
+                       if i.get(hash_attr) == wanted and range_attr in i]
+        matches.sort(key=lambda i: (i[range_attr], i[self.key]), reverse=not ScanIndexForward)
+        return self._page(matches, Limit, ExclusiveStartKey)
+
+    def scan(self, Limit=None, ExclusiveStartKey=None, Segment=None, TotalSegments=None, **kwargs):
+        self._count("Scan")
+        with self.lock:
+            keys = sorted(self.items)
+            if TotalSegments:
+                keys = [k for k in keys if _segment(k, TotalSegments) == Segment]
+            items = [copy.deepcopy(self.items[k]) for k in keys]
+        return self._page(items, Limit, ExclusiveStartKey)
+
+    def _page(self, items, limit, start_key):
+        if start_key is not None:
+            position = next((n for n, i in enumerate(items) if i[self.key] == start_key[self.key]), -1)
+            items = items[position + 1:]
+        if limit is None or len(items) <= limit:
+            return {"Items": items, "Count": len(items)}
+        page = items[:limit]
+        return {"Items": page, "Count": len(page), "LastEvaluatedKey": {self.key: page[-1][self.key]}}
+
+
+def _segment(key, total):
+    return int(hashlib.md5(str(key).encode("utf-8")).hexdigest(), 16) % total
+
+
+class FakeDynamoDB:
+    """Stands in for the DynamoDB client; only transact_write_items is used"""
+
+    def __init__(self, *tables, latency=NO_LATENCY):
+        self.tables = {t.name: t for t in tables}
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = CallCounter()
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self.latency.wait()
+        self.calls.add("TransactWriteItems")
+        updates = []
+        for entry in TransactItems:
+            (kind, spec), = entry.items()
+            if kind != "Update":
+                raise ValueError(f"Unsupported transaction item {kind}")
+            updates.append(spec)
+        tables = [self.tables[spec["TableName"]] for spec in updates]
+        with self.lock:
+            for table in set(tables):
+                table.lock.acquire()
+            try:
+                reasons = []
+                for table, spec in zip(tables, updates):
+                    ok = table.check(spec["Key"], spec.get("ConditionExpression"),
+                                     spec.get("ExpressionAttributeNames"), spec.get("ExpressionAttributeValues"))
+                    reasons.append({"Code": "None" if ok else "ConditionalCheckFailed"})
+                if any(r["Code"] != "None" for r in reasons):
+                    raise _client_error("TransactionCanceledException", "TransactWriteItems",
+                                        "Transaction cancelled", CancellationReasons=reasons)
+                for table, spec in zip(tables, updates):
+                    table.apply_update(spec["Key"], spec["UpdateExpression"], spec.get("ExpressionAttributeNames"),
+                                       spec.get("ExpressionAttributeValues"), None, "TransactWriteItems")
+            finally:
+                for table in set(tables):
+                    table.lock.release()
+        return {}
+
+
+# ----------------------------
+# Amazon Location
+# ----------------------------
+class FakeLocationClient:
+    """Deterministic geocoder (text hash -> campus point) and speed-model router"""
+
+    def __init__(self, latency=NO_LATENCY):
+        self.latency = latency
+        self.calls = CallCounter()
+
+    def _count(self, operation):
+        self.latency.wait()
+        self.calls.add(operation)
+
+    def search_place_index_for_text(self, IndexName, Text, MaxResults=1, **kwargs):
+        self._count("SearchPlaceIndexForText")
+        digest = hashlib.sha256(Text.lower().encode("utf-8")).digest()
+        b = CAMPUS_BOUNDS
+        lat = b["lat_min"] + (b["lat_max"] - b["lat_min"]) * digest[0] / 255
+        lon = b["lon_min"] + (b["lon_max"] - b["lon_min"]) * digest[1] / 255
+        return {"Results": [{"Place": {"Label": Text, "Geometry": {"Point": [lon, lat]}}}]}
+
+    def search_place_index_for_position(self, IndexName, Position, **kwargs):
+        self._count("SearchPlaceIndexForPosition")
+        lon, lat = Position
+        return {"Results": [{"Place": {"Label": f"{lat:.5f}, {lon:.5f}"}}]}
+
+    def calculate_route(self, CalculatorName, DeparturePosition, DestinationPosition,
+                        IncludeLegGeometry=False, WaypointPositions=(), **kwargs):
+        self._count("CalculateRoute")
+        positions = [DeparturePosition, *WaypointPositions, DestinationPosition]
+        legs = []
+        for (lon1, lat1), (lon2, lat2) in zip(positions, positions[1:]):
+            seconds = float(estimate_seconds(lat1, lon1, lat2, lon2))
+            km = float(haversine_meters(lat1, lon1, lat2, lon2)) / 1000
+            leg = {"DurationSeconds": seconds, "Distance": km}
+            if IncludeLegGeometry:
+                leg["Geometry"], leg["Steps"] = self._straight_line(lon1, lat1, lon2, lat2, seconds, km)
+            legs.append(leg)
+        summary = {"DurationSeconds": sum(l["DurationSeconds"] for l in legs), "Distance": sum(l["Distance"] for l in legs)}
+        return {"Legs": legs, "Summary": summary}
+
+    @staticmethod
+    def _straight_line(lon1, lat1, lon2, lat2, seconds, km, spacing_m=25):
+        """Densified straight polyline split into two equal steps"""
+        n = max(2, int(km * 1000 / spacing_m) + 1)
+        line = [[lon1 + (lon2 - lon1) * i / (n - 1), lat1 + (lat2 - lat1) * i / (n - 1)] for i in range(n)]
+        middle = (n - 1) // 2
+        steps = [
+            {"StartPosition": line[start], "EndPosition": line[end], "Distance": km * (end - start) / (n - 1),
+             "DurationSeconds": seconds * (end - start) / (n - 1), "GeometryOffset": start}
+            for start, end in ((0, middle), (middle, n - 1)) if end > start
+        ]
+        return {"LineString": line}, steps
+
+
+# ----------------------------
+# Bedrock
+# ----------------------------
+class FakeBedrock:
+    """Answers the batched extraction prompt by echoing each quoted request back"""
+
+    def __init__(self, latency=NO_LATENCY):
+        self.latency = latency
+        self.calls = CallCounter()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.latency.wait()
+        self.calls.add("InvokeModel")
+        prompt = json.loads(body)["messages"][0]["content"]
+        requests = re.findall(r'^\s*\d+\. "(.*)"$', prompt, re.MULTILINE)
+        text = json.dumps({"locations": [r.split(" at ")[-1].split(" to ")[-1] for r in requests]})
+        payload = {"content": [{"type": "text", "text": text}]}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+
+
+# ----------------------------
+# Installation
+# ----------------------------
+def install(latency=NO_LATENCY):
+    """
+    Swap the AWS clients in db and bedrock for fakes sharing one latency
+    model; storage goes through the real DynamoStore code path. Returns
+    the fakes so callers can seed tables or read call counts.
+    """
+    import db
+    import bedrock
+    from storage import DynamoStore, RIDES_STATUS_INDEX
+
+    rides = FakeTable("Rides", "ride_id", latency=latency, indexes={
+        RIDES_STATUS_INDEX: ("status", "timestamp"),
+    })
+    drivers = FakeTable("Drivers", "driver_id", latency=latency)
+    fakes = SimpleNamespace(
+        rides_table=rides,
+        drivers_table=drivers,
+        dynamodb=FakeDynamoDB(rides, drivers, latency=latency),
+        location_client=FakeLocationClient(latency=latency),
+        bedrock=FakeBedrock(latency=latency),
+    )
+    db.store = DynamoStore(rides, drivers, fakes.dynamodb)
+    db.location_client = fakes.location_client
+    bedrock.bedrock = fakes.bedrock
+    db.driver_index.seed([])
+    return fakes
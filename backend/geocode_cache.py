@@ -0,0 +1,170 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+POSITIVE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+NEGATIVE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL_SECONDS", str(24 * 3600)))
+
+# Common pickup / dropoff spots, used to warm the cache before a shift
+CAMPUS_LOCATIONS = [
+    "Suzzallo Library",
+    "Odegaard Undergraduate Library",
+    "Allen Library",
+    "Husky Union Building",
+    "Red Square",
+    "Drumheller Fountain",
+    "Kane Hall",
+    "Paul G. Allen Center for Computer Science & Engineering",
+    "Husky Stadium",
+    "IMA Building",
+    "UW Medical Center",
+    "UW Tower",
+    "McMahon Hall",
+    "Haggett Hall",
+    "Willow Hall",
+    "Maple Hall",
+    "Alder Hall",
+    "Elm Hall",
+    "Lander Hall",
+    "Terry Hall",
+    "Poplar Hall",
+    "Oak Hall",
+    "Madrona Hall",
+    "Hansee Hall",
+    "Mercer Court",
+    "University Village",
+    "U District Station",
+    "University Way NE & NE 45th St",
+]
+
+
+def normalize(text):
+    """Case-, whitespace- and punctuation-insensitive cache key for free-form addresses"""
+    text = text.strip().lower()
+    text = re.sub(r"[^\w\s&#-]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# ----------------------------
+# Geocode Cache
+# ----------------------------
+class GeocodeCache:
+    """
+    SQLite-backed cache for forward and reverse geocoding results.
+    Misses are cached too (with a shorter TTL) so invalid addresses
+    don't cost a Location service call every time.
+    """
+
+    MISSING = object()
+
+    def __init__(self, path, positive_ttl=POSITIVE_TTL_SECONDS, negative_ttl=NEGATIVE_TTL_SECONDS):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                lat REAL,
+                lon REAL,
+                address TEXT,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _get(self, kind, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lon, address, expires_at FROM geocode WHERE kind = ? AND key = ?",
+                (kind, key),
+            ).fetchone()
+            if row is None or row[3] <= time.time():
+                self.misses += 1
+                return self.MISSING
+            self.hits += 1
+            return row[:3]
+
+    def _put(self, kind, key, lat, lon, address):
+        ttl = self.positive_ttl if address is not None else self.negative_ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (kind, key, lat, lon, address, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, lat, lon, address, time.time() + ttl),
+            )
+            self._conn.commit()
+
+    def get_address(self, address_text):
+        """Cached geocode result dict, None for a cached miss, or MISSING"""
+        row = self._get("forward", normalize(address_text))
+        if row is self.MISSING:
+            return row
+        lat, lon, address = row
+        if address is None:
+            return None
+        return {"lat": lat, "lon": lon, "address": address}
+
+    def put_address(self, address_text, result):
+        if result is None:
+            self._put("forward", normalize(address_text), None, None, None)
+        else:
+            self._put("forward", normalize(address_text), result["lat"], result["lon"], result["address"])
+
+    def get_position(self, lat, lon):
+        """Cached reverse-geocode label, None for a cached miss, or MISSING"""
+        row = self._get("reverse", position_key(lat, lon))
+        if row is self.MISSING:
+            return row
+        return row[2]
+
+    def put_position(self, lat, lon, label):
+        self._put("reverse", position_key(lat, lon), lat, lon, label)
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM geocode WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": (self.hits / total) if total else 0.0}
+
+
+def position_key(lat, lon):
+    # 5 decimal places ~= 1 m, well below geocoder resolution
+    return f"{float(lat):.5f},{float(lon):.5f}"
+
+
+geocode_cache = GeocodeCache(os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3"))
+
+
+def warm(locations=CAMPUS_LOCATIONS):
+    """Geocode every location once so ride requests for them are served locally"""
+    from db import geocode_address
+
+    for text in locations:
+        result = geocode_address(text)
+        print(f"{text!r} -> {result['address'] if result else None}")
+
+
+if __name__ == "__main__":
+    # python geocode_cache.py [locations.txt]
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            warm([line.strip() for line in f if line.strip()])
+    else:
+        warm()
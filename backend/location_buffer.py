@@ -0,0 +1,138 @@
+import atexit
+import logging
+import os
+import threading
+import datetime
+from decimal import Decimal
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("LOCATION_FLUSH_INTERVAL_SECONDS", "15"))
+FLUSH_DIRTY_THRESHOLD = int(os.getenv("LOCATION_FLUSH_DIRTY_THRESHOLD", "100"))
+
+
+# ----------------------------
+# Write-Behind Location Store
+# ----------------------------
+class LocationBuffer:
+    """
+    In-memory latest position per driver, flushed to storage in the background.
+
+    Pings are acknowledged as soon as they are in memory; repeated pings from
+    the same driver coalesce (last write wins), so storage writes scale with
+    the number of drivers rather than ping frequency.
+    """
+
+    def __init__(self, writer, interval=FLUSH_INTERVAL_SECONDS, dirty_threshold=FLUSH_DIRTY_THRESHOLD):
+        self.writer = writer  # writer(driver_id, lat, lon, last_updated)
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self.positions = {}  # driver_id -> {"lat", "lon", "last_updated"}
+        self.dirty = set()
+        self.pings = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def update(self, driver_id, lat, lon):
+        with self._lock:
+            self.positions[driver_id] = {
+                "lat": Decimal(str(lat)),
+                "lon": Decimal(str(lon)),
+                "last_updated": datetime.datetime.utcnow().isoformat(),
+            }
+            self.dirty.add(driver_id)
+            self.pings += 1
+            over_threshold = len(self.dirty) >= self.dirty_threshold
+        self._ensure_started()
+        if over_threshold:
+            self._wakeup.set()
+
+    def apply(self, driver_id, lat, lon, last_updated):
+        """
+        Position reported by another worker's ping. Kept so this worker
+        serves it too, but not marked dirty: the receiving worker flushes it.
+        """
+        with self._lock:
+            current = self.positions.get(driver_id)
+            if current is None or current["last_updated"] < last_updated:
+                self.positions[driver_id] = {
+                    "lat": Decimal(str(lat)),
+                    "lon": Decimal(str(lon)),
+                    "last_updated": last_updated,
+                }
+
+    def get(self, driver_id):
+        with self._lock:
+            position = self.positions.get(driver_id)
+            return dict(position) if position else None
+
+    def overlay(self, driver):
+        """Apply the buffered position (if newer than storage's) to a driver item"""
+        if not driver:
+            return driver
+        position = self.get(driver["driver_id"])
+        if position and position["last_updated"] >= driver.get("last_updated", ""):
+            driver = dict(driver, **position)
+        return driver
+
+    def snapshot(self):
+        with self._lock:
+            return {driver_id: dict(p) for driver_id, p in self.positions.items()}
+
+    def flush(self):
+        """Write every dirty driver once; failed writes stay dirty for the next flush"""
+        with self._flush_lock:
+            with self._lock:
+                batch = {driver_id: dict(self.positions[driver_id]) for driver_id in self.dirty}
+                self.dirty.clear()
+            failed = []
+            for driver_id, p in batch.items():
+                try:
+                    self.writer(driver_id, p["lat"], p["lon"], p["last_updated"])
+                    self.writes += 1
+                except Exception as e:
+                    logger.warning("Location flush error", extra={"driver_id": driver_id, "error": str(e)})
+                    failed.append(driver_id)
+            if failed:
+                with self._lock:
+                    self.dirty.update(failed)
+            return len(batch) - len(failed)
+
+    def _ensure_started(self):
+        if self._thread is None and not self._stopped.is_set():
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="location-flush", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the flusher and durably write everything still buffered"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {"drivers": len(self.positions), "dirty": len(self.dirty), "pings": self.pings, "writes": self.writes}
+
+
+def start_location_buffer(writer):
+    buffer = LocationBuffer(writer)
+    atexit.register(buffer.close)
+    return buffer
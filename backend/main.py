@@ -1,25 +1,131 @@
 
-from fastapi import FastAPI, APIRouter, WebSocket
+from fastapi import FastAPI, APIRouter, WebSocket, Request, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict, Set
-from db import (
+from typing import Optional
+from async_db import (
     geocode_address,
-    calculate_route_minutes_seconds,
+    get_in_car_eta,
     create_ride,
-    get_all_rides,
-    update_ride_status,
-    get_all_drivers,
-    update_driver_location,
+    get_queue_snapshot,
     get_driver_by_id,
-    get_ride_by_id
+    get_ride_by_id,
+    get_queue_eta,
+    get_queue_etas,
+    parse_pickup_and_destination,
+    record_driver_ping,
+    accept_ride_transaction,
+    complete_ride_transaction
 )
+from db import get_active_ride_ids, iter_rides, RideConflictError, driver_locations, driver_index
+from queue_eta import queue_eta
+from queue_snapshot import queue_snapshot
+from ws_hub import hub, SseStream
+from pubsub import ride_bus
+from queue_versions import queue_versions
+from trajectory import trajectories
+from route_tracker import route_tracker
+from changes import change_feed, RIDE_CREATED, RIDE_ACCEPTED, RIDE_COMPLETED, DRIVER_MOVED
+from route_cache import route_cache
+from geocode_cache import geocode_cache
+from metrics import registry, http_request_seconds
+from log_config import configure_logging
+import async_db
 import asyncio
+import datetime
 import json
+import logging
+import orjson
+import os
+import time
 
-app = FastAPI(title="Campus Escort Backend")
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Optional automatic dispatch: batch-assign the queue every tick
+AUTO_ASSIGN = os.getenv("AUTO_ASSIGN", "false").lower() == "true"
+ASSIGNMENT_TICK_SECONDS = float(os.getenv("ASSIGNMENT_TICK_SECONDS", "10"))
+# Shared rides: group compatible riders into multi-stop trips when dispatching
+POOLING = os.getenv("POOLING", "false").lower() == "true"
+# Parallel DynamoDB scan segments behind the ride export
+RIDES_EXPORT_SEGMENTS = int(os.getenv("RIDES_EXPORT_SEGMENTS", "4"))
+
+# orjson for every response; the queue endpoints return ORJSONResponse directly
+# so their ride records skip jsonable_encoder entirely
+app = FastAPI(title="Campus Escort Backend", default_response_class=ORJSONResponse)
 router = APIRouter()
 
+# Change feed kinds that reshape the whole queue, as ride bus event types
+QUEUE_EVENTS = {RIDE_CREATED: "requested", RIDE_ACCEPTED: "accepted", RIDE_COMPLETED: "completed"}
+# Tags this worker's bus events; its own changes already reached its caches through the change feed
+WORKER_ID = os.getpid()
+
+@app.on_event("startup")
+async def start_ride_bus():
+    await ride_bus.start(deliver_ride_update)
+    start_change_forwarding()
+    if AUTO_ASSIGN:
+        asyncio.create_task(assignment_loop())
+
+def start_change_forwarding():
+    """
+    Relay data-layer changes onto the ride bus in version order. Writes
+    happen on executor threads, so changes hop onto the event loop first;
+    position-only pings with nobody in the car (and no new driver) are
+    dropped before the hop.
+    """
+    loop = asyncio.get_running_loop()
+    changes = asyncio.Queue()
+
+    def on_change(change):
+        if change["kind"] == DRIVER_MOVED and not change.get("ride_ids") and not change.get("joined"):
+            return
+        loop.call_soon_threadsafe(changes.put_nowait, change)
+
+    async def forward():
+        while True:
+            change = await changes.get()
+            try:
+                if change["kind"] == DRIVER_MOVED:
+                    # Only this worker buffered the ping; the position rides along for the others
+                    event = {
+                        "type": "location", "version": change["version"], "origin": WORKER_ID,
+                        "driver_id": change["driver_id"], "lat": change["lat"], "lon": change["lon"],
+                        "last_updated": datetime.datetime.utcfromtimestamp(change["at"]).isoformat(),
+                    }
+                    for ride_id in change["ride_ids"]:
+                        await ride_bus.publish(ride_id, event)
+                    if change.get("joined"):
+                        # A new driver moves every waiting rider's ETA; no single ride owns the event
+                        await ride_bus.publish(None, dict(event, type="drivers"))
+                else:
+                    event_type = QUEUE_EVENTS.get(change["kind"], "status")
+                    await ride_bus.publish(change["ride_id"], {"type": event_type, "version": change["version"],
+                                                               "origin": WORKER_ID})
+            except Exception:
+                logger.exception("Change forwarding error", extra={"version": change["version"]})
+
+    app.state.change_subscriber = change_feed.subscribe(on_change)
+    app.state.change_forwarder = asyncio.create_task(forward())
+
+async def assignment_loop():
+    while True:
+        await asyncio.sleep(ASSIGNMENT_TICK_SECONDS)
+        try:
+            # Assignments reach riders and the ETA snapshot through the change feed
+            await (async_db.assign_pools() if POOLING else async_db.assign_next_ride())
+        except Exception:
+            logger.exception("Assignment tick error")
+
+@app.on_event("shutdown")
+async def shutdown_hub_and_executor():
+    change_feed.unsubscribe(app.state.change_subscriber)
+    app.state.change_forwarder.cancel()
+    await ride_bus.close()
+    await hub.close()
+    async_db.shutdown()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -28,8 +134,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store active WebSocket connections per ride
-active_connections: Dict[str, Set[WebSocket]] = {}
+# ----------------------------
+# Metrics
+# ----------------------------
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template so /driver_view/{id} is one series, not one per driver
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    http_request_seconds.observe(time.perf_counter() - start, request.method, path, str(response.status_code))
+    return response
+
+registry.gauge("cache_hit_ratio", "Hit ratio per cache", "cache", lambda: {
+    "route": route_cache.stats()["hit_ratio"],
+    "geocode": geocode_cache.stats()["hit_ratio"],
+})
+registry.gauge("cache_lookups", "Hits and misses per cache", "result", lambda: {
+    "route_hit": route_cache.stats()["hits"],
+    "route_miss": route_cache.stats()["misses"],
+    "geocode_hit": geocode_cache.stats()["hits"],
+    "geocode_miss": geocode_cache.stats()["misses"],
+})
+registry.gauge("websocket_hub", "Subscriber counts and queue health", "stat", hub.metrics)
+registry.gauge("location_buffer", "Buffered driver positions and write-behind counts", "stat", driver_locations.stats)
+registry.gauge("trajectory_store", "Driver position history size and spills", "stat", trajectories.stats)
+registry.gauge("queue_snapshot", "Shared driver queue reads vs storage rebuilds", "stat", queue_snapshot.stats)
+registry.gauge("route_tracker", "In-car ETAs projected locally vs route calls", "stat", route_tracker.stats)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
 
 class RideRequest(BaseModel):
     name: str
@@ -38,87 +175,74 @@ class RideRequest(BaseModel):
     destination_address: str
     notes: Optional[str] = ""
 
+class RideRequestText(BaseModel):
+    pickup_text: str
+    destination_text: str
+
 class LocationUpdate(BaseModel):
     driver_id: str
     lat: float
     lon: float
     current_ride_id: Optional[str] = None
 
+class DriverHeartbeat(BaseModel):
+    driver_id: str
+    lat: float
+    lon: float
+    queue_version: Optional[str] = None
+
+@app.post("/parse_ride_request")
+async def parse_ride_request_endpoint(req: RideRequestText):
+    """Pickup / destination place names from the rider's free text (one Bedrock call)"""
+    pickup, destination = await parse_pickup_and_destination(req.pickup_text, req.destination_text)
+    return {"pickup": pickup, "destination": destination}
+
 @app.post("/request_ride")
-def request_ride_endpoint(ride_req: RideRequest):
-    pickup = geocode_address(ride_req.pickup_address)
-    destination = geocode_address(ride_req.destination_address)
+async def request_ride_endpoint(ride_req: RideRequest):
+    pickup, destination = await asyncio.gather(
+        geocode_address(ride_req.pickup_address),
+        geocode_address(ride_req.destination_address)
+    )
     if not pickup or not destination:
         return {"error": "Invalid pickup or destination address"}
-    ride = create_ride(ride_req.name, ride_req.uw_id, pickup, destination, ride_req.notes)
-    return ride
+    return await create_ride(ride_req.name, ride_req.uw_id, pickup, destination, ride_req.notes)
+
+def waiting_status(entry):
+    """Rider status for a waiting ride, from its queue ETA entry"""
+    if entry["eta_seconds"] is None:
+        return {"error": "No drivers available"}
+    total_eta_seconds = entry["eta_seconds"]
+    return {
+        "queue_position": entry["queue_position"],
+        "eta": f"{total_eta_seconds // 60} min {total_eta_seconds % 60} sec",
+        "status": "waiting",
+        "driver_location": entry["driver_location"]
+    }
 
 @app.get("/client_status/{ride_id}")
-def client_status(ride_id: str):
-    ride = get_ride_by_id(ride_id)
+async def client_status(ride_id: str):
+    ride = await get_ride_by_id(ride_id)
     if not ride:
         return {"error": "Ride not found"}
 
-    # Get all waiting rides in queue order
-    rides = [r for r in get_all_rides() if r["status"] == "waiting"]
     if ride["status"] == "waiting":
-        position = next((i for i, r in enumerate(rides) if r["ride_id"] == ride_id), None)
-        if position is None:
+        # Queue ETAs are precomputed once per queue change and shared by all riders
+        entry = await get_queue_eta(ride_id)
+        if entry is None:
             return {"error": "Ride not in queue"}
-
-        # Find a driver to base the ETA on
-        # (Here we just pick the *first available driver* — you might want smarter assignment logic)
-        drivers = get_all_drivers()
-        available_drivers = [d for d in drivers if d.get("available", True)]
-        if not available_drivers:
-            return {"error": "No drivers available"}
-
-        driver = available_drivers[0]  # For now, just take the first one
-        current_latlon = {"lat": float(driver["lat"]), "lon": float(driver["lon"])}
-
-        total_eta_seconds = 0
-        current_point = current_latlon
-
-        # Go through each ride ahead in the queue, accumulating:
-        # driver → pickup → destination
-        for r in rides[:position]:
-            # Driver to this pickup
-            m1, s1 = calculate_route_minutes_seconds(current_point, r["pickup"])
-            if m1 is not None:
-                total_eta_seconds += m1 * 60 + s1
-
-            # Pickup to this destination
-            m2, s2 = calculate_route_minutes_seconds(r["pickup"], r["destination"])
-            if m2 is not None:
-                total_eta_seconds += m2 * 60 + s2
-
-            # Update the current point to this dropoff
-            current_point = r["destination"]
-
-        # Finally, add ETA from last dropoff to this ride’s pickup
-        m3, s3 = calculate_route_minutes_seconds(current_point, ride["pickup"])
-        if m3 is not None:
-            total_eta_seconds += m3 * 60 + s3
-
-        return {
-            "queue_position": position + 1,
-            "eta": f"{total_eta_seconds // 60} min {total_eta_seconds % 60} sec",
-            "status": "waiting",
-            "driver_location": current_latlon
-        }
+        return waiting_status(entry)
 
     elif ride["status"] == "in_car":
         driver_id = ride.get("driver_id")
         if not driver_id:
             return {"error": "No driver assigned"}
         
-        driver = get_driver_by_id(driver_id)
+        driver = await get_driver_by_id(driver_id)
         if not driver:
             return {"error": "Driver not found"}
 
-        current_pos = {"lat": float(driver.get("lat", 0)), "lon": float(driver.get("lon", 0))}
-        m, s = calculate_route_minutes_seconds(current_pos, ride["destination"])
-        eta_seconds = (m * 60 + s) if m is not None else 0
+        current_pos = {"lat": driver.get("lat", 0.0), "lon": driver.get("lon", 0.0)}
+        eta_seconds = await get_in_car_eta(ride_id, current_pos, ride["destination"])
 
         return {
             "queue_position": None,
@@ -141,96 +265,180 @@ def client_status(ride_id: str):
 
 @app.websocket("/ws/ride/{ride_id}")
 async def websocket_ride_updates(websocket: WebSocket, ride_id: str):
-    await websocket.accept()
-    
-    if ride_id not in active_connections:
-        active_connections[ride_id] = set()
-    active_connections[ride_id].add(websocket)
-    
-    try:
-        while True:
-            await websocket.receive_text()
-    except Exception as e:
-        active_connections[ride_id].discard(websocket)
-        if not active_connections[ride_id]:
-            del active_connections[ride_id]
+    conn = await hub.connect(ride_id, websocket)
+    # Current status first, then one message per change
+    hub.publish(ride_id, await client_status(ride_id))
+    await hub.receive_loop(conn)
+
+@app.get("/sse/ride/{ride_id}")
+async def sse_ride_updates(ride_id: str):
+    """Server-Sent Events version of /ws/ride for clients without WebSockets"""
+    stream = SseStream()
+    conn = await hub.connect(ride_id, stream)
+    hub.publish(ride_id, await client_status(ride_id))
+
+    async def events():
+        try:
+            async for message in stream.messages(conn):
+                yield f"data: {json.dumps(message, default=str)}\n\n"
+        finally:
+            await hub.disconnect(conn)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def push_status(ride_id):
+    status_data = await client_status(ride_id)
+    if status_data.get("error") != "Ride not found":
+        hub.publish(ride_id, status_data)
+
+async def push_queue_statuses(skip=None):
+    """
+    After a queue change, push fresh positions / ETAs to every subscribed
+    waiting rider, straight from the queue ETA snapshot. Rides in a car or
+    completed are untouched by queue changes and only get pushed through
+    their own ride event.
+    """
+    if not any(ride_id != skip for ride_id in hub.subscribed_ride_ids()):
+        return
+    entries = await get_queue_etas()
+    for ride_id in hub.subscribed_ride_ids():
+        entry = entries.get(ride_id)
+        if ride_id != skip and entry is not None:
+            hub.publish(ride_id, waiting_status(entry))
+
+async def deliver_ride_update(ride_id, event):
+    """Ride bus handler: every worker pushes fresh status to its own subscribers"""
+    foreign = event.get("origin") != WORKER_ID
+    if event.get("type") in ("location", "drivers") and foreign and "lat" in event:
+        driver_locations.apply(event["driver_id"], event["lat"], event["lon"], event["last_updated"])
+    if event.get("type") == "drivers" and foreign:
+        # The new driver joins this worker's pool too
+        driver_index.upsert(event["driver_id"], event["lat"], event["lon"])
+        queue_eta.invalidate()
+    elif event.get("type") != "location" and foreign:
+        # Keep this worker's queue snapshots in step with mutations made elsewhere
+        queue_snapshot.invalidate()
+        if event.get("type") != "status":
+            queue_eta.invalidate()
+        if event.get("type") == "completed":
+            # This worker may have tracked the ride's route for its own subscribers
+            route_tracker.forget(ride_id)
+    if event.get("type") == "drivers":
+        await push_queue_statuses()
+    elif event.get("type") in ("requested", "accepted", "completed"):
+        # The ride that changed goes out without waiting on the queue ETA rebuild;
+        # queue positions / ETAs of every other waiting rider may have moved too
+        own = push_status(ride_id) if hub.has_subscribers(ride_id) else asyncio.sleep(0)
+        await asyncio.gather(own, push_queue_statuses(skip=ride_id))
+    elif hub.has_subscribers(ride_id):
+        await push_status(ride_id)
+
+@app.get("/rides/export")
+def export_rides(limit: Optional[int] = None):
+    """
+    Every ride (up to limit) as newline-delimited JSON for admin / analytics,
+    streamed straight from the scan; a disconnecting client stops the scan.
+    """
+    rides = iter_rides(limit=limit, segments=RIDES_EXPORT_SEGMENTS)
+    return StreamingResponse((orjson.dumps(ride) + b"\n" for ride in rides), media_type="application/x-ndjson")
+
+@app.get("/ws/metrics")
+def websocket_metrics():
+    return hub.metrics()
 
 @app.post("/update_driver_location")
 async def update_driver_location_endpoint(location: LocationUpdate):
     """Driver sends real-time location updates"""
-    update_driver_location(
-        location.driver_id,
-        location.lat,
-        location.lon,
-        current_ride_id=location.current_ride_id
-    )
-    
-    # If driver has an active ride, notify the student
-    if location.current_ride_id:
-        ride = get_ride_by_id(location.current_ride_id)
-        if ride and location.current_ride_id in active_connections:
-            status_data = client_status(location.current_ride_id)
-            
-            # Send update to all connected clients for this ride
-            for connection in active_connections[location.current_ride_id]:
-                try:
-                    await connection.send_json(status_data)
-                except Exception as e:
-                    print(f"Error sending update: {e}")
-    
+    # With a rider in the car, the change feed pushes the move to them (on whichever worker holds the socket)
+    ride_ids = [location.current_ride_id] if location.current_ride_id else []
+    record_driver_ping(location.driver_id, location.lat, location.lon, ride_ids)
     return {"status": "location updated"}
 
-@app.get("/driver_view/{driver_id}")
-def driver_view(driver_id: str):
-    driver = get_driver_by_id(driver_id)
-    current_ride = None
-    if driver and driver.get("current_ride_id"):
-        current_ride = get_ride_by_id(driver["current_ride_id"])
-    queue = [r for r in get_all_rides() if r["status"] == "waiting"]
-    return {
-        "current_ride": current_ride,
-        "queue": queue
+async def rides_in_car(ride_ids, snapshot):
+    """Rides in car order, from the snapshot; storage only for rides it has not seen yet"""
+    rides = [snapshot["in_car"].get(ride_id) for ride_id in ride_ids]
+    missing = iter(await asyncio.gather(*(
+        get_ride_by_id(ride_id) for ride_id, ride in zip(ride_ids, rides) if ride is None
+    )))
+    return [r for r in (ride if ride is not None else next(missing) for ride in rides) if r]
+
+def with_queue(body, queue_json, headers=None):
+    """JSON response of body plus a "queue" array that is already serialized"""
+    content = orjson.dumps(body)[:-1] + b',"queue":' + queue_json + b"}"
+    return Response(content, media_type="application/json", headers=headers)
+
+@app.post("/driver_heartbeat")
+async def driver_heartbeat(beat: DriverHeartbeat, request: Request):
+    """
+    Combined driver ping + dashboard refresh. Returns only the queue changes
+    since beat.queue_version, and 304 when neither the queue nor the
+    driver's assignment changed (If-None-Match).
+    """
+    driver, snapshot = await asyncio.gather(get_driver_by_id(beat.driver_id), get_queue_snapshot())
+    active_ride_ids = get_active_ride_ids(driver) if driver else []
+    route_stops = driver.get("route_stops", []) if driver else []
+    record_driver_ping(beat.driver_id, beat.lat, beat.lon, active_ride_ids)
+
+    version = snapshot["version"]
+    assignment = json.dumps([active_ride_ids, route_stops], sort_keys=True, default=str)
+    etag = f'"{version}.{queue_versions.version_of([assignment])}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    active_rides = await rides_in_car(active_ride_ids, snapshot)
+    body = {
+        "queue_version": version,
+        "current_ride": active_rides[0] if active_rides else None,
+        "active_rides": active_rides,
+        "route_stops": route_stops,
     }
+    delta = queue_versions.delta(beat.queue_version, snapshot["queue"]) if beat.queue_version else None
+    if delta is None:
+        body["full"] = True
+        return with_queue(body, snapshot["queue_json"], headers={"ETag": etag})
+    body["full"] = False
+    body["added"], body["removed"] = delta
+    return ORJSONResponse(body, headers={"ETag": etag})
+
+@app.get("/driver_trajectory/{driver_id}")
+def driver_trajectory(driver_id: str, start: Optional[float] = None, end: Optional[float] = None,
+                      include_spilled: bool = False):
+    """Recorded positions between start and end (unix seconds), for replay and disputes"""
+    points = trajectories.query(driver_id, start, end, include_spilled)
+    return {"driver_id": driver_id, "points": points, "speed_mps": trajectories.speed_mps(driver_id)}
+
+@app.get("/driver_view/{driver_id}")
+async def driver_view(driver_id: str):
+    # The queue is shared by every driver; only the driver's own rides are per request
+    driver, snapshot = await asyncio.gather(get_driver_by_id(driver_id), get_queue_snapshot())
+    active_rides = await rides_in_car(get_active_ride_ids(driver) if driver else [], snapshot)
+    return with_queue({
+        "current_ride": active_rides[0] if active_rides else None,
+        "active_rides": active_rides,
+        "route_stops": driver.get("route_stops", []) if driver else [],
+    }, snapshot["queue_json"])
 
 @app.post("/complete_ride/{ride_id}")
-def complete_ride(ride_id: str):
-    ride = get_ride_by_id(ride_id)
-    if ride and ride.get("driver_id"):
-        driver = get_driver_by_id(ride["driver_id"])
-        if driver:
-            # Set driver as available again
-            update_driver_location(
-                ride["driver_id"],
-                float(driver.get("lat", 0)),
-                float(driver.get("lon", 0)),
-                available=True,
-                current_ride_id=None
-            )
-    
-    update_ride_status(ride_id, "completed")
+async def complete_ride(ride_id: str):
+    # Ride and driver are updated together; the driver frees up once the car is empty
+    try:
+        await complete_ride_transaction(ride_id)
+    except RideConflictError as e:
+        return {"error": str(e)}
     return {"status": "ride completed"}
 
 @app.post("/accept_ride/{driver_id}/{ride_id}")
-def accept_ride(driver_id: str, ride_id: str):
+async def accept_ride(driver_id: str, ride_id: str):
     """Driver accepts a ride from the queue"""
-    driver = get_driver_by_id(driver_id)
-    if not driver:
-        return {"error": "Driver not found"}
-    
-    ride = get_ride_by_id(ride_id)
-    if not ride or ride["status"] != "waiting":
-        return {"error": "Ride not available"}
-    
-    # Assign ride to driver
-    update_ride_status(ride_id, "in_car", driver_id)
-    update_driver_location(
-        driver_id,
-        float(driver.get("lat", 0)),
-        float(driver.get("lon", 0)),
-        available=False,
-        current_ride_id=ride_id
-    )
-    
+    # Conditional transaction: only one driver can take a waiting ride
+    try:
+        await accept_ride_transaction(driver_id, ride_id)
+    except RideConflictError as e:
+        return {"error": str(e)}
     return {"status": "ride accepted"}
 
 app.include_router(router)
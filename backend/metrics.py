@@ -0,0 +1,167 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds (Prometheus "le" upper bounds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# ----------------------------
+# Metric Types
+# ----------------------------
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _label_str(self.labels + ("le",), label_values + (repr(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_str(self.labels + ("le",), label_values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                base = _label_str(self.labels, label_values)
+                lines.append(f"{self.name}_sum{base} {series[-2]}")
+                lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+class GaugeCollector:
+    """Gauges read from a callback at scrape time: callback() -> {label value: number}"""
+
+    def __init__(self, name, help_text, label, callback):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception:
+            return lines
+        for key, value in sorted(values.items()):
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_label_str((self.label,), (key,))} {value}")
+        return lines
+
+
+# ----------------------------
+# Registry
+# ----------------------------
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, label, callback):
+        return self.register(GaugeCollector(name, help_text, label, callback))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Endpoint latency", ("method", "route", "status")
+))
+aws_calls = registry.register(Counter(
+    "aws_calls_total", "AWS API calls", ("service", "operation", "outcome")
+))
+aws_call_seconds = registry.register(Histogram(
+    "aws_call_duration_seconds", "AWS API call latency", ("service", "operation")
+))
+
+
+# ----------------------------
+# boto3 Instrumentation
+# ----------------------------
+def instrument_boto_client(client):
+    """Count and time every API call made through a boto3 client"""
+    service = client.meta.service_model.service_name
+
+    def before_call(model, context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+        context["metrics_operation"] = model.name
+
+    def after_call(http_response, context, **kwargs):
+        # Emitted for AWS error responses too; ClientError is raised afterwards
+        _record(context, "ok" if http_response.status_code < 300 else "error")
+
+    def after_call_error(context, **kwargs):
+        # Connection / timeout failures that never produced a response
+        _record(context, "error")
+
+    def _record(context, outcome):
+        start = context.pop("metrics_start", None)
+        operation = context.get("metrics_operation", "unknown")
+        aws_calls.inc(service, operation, outcome)
+        if start is not None:
+            aws_call_seconds.observe(time.perf_counter() - start, service, operation)
+
+    events = client.meta.events
+    events.register("before-call", before_call)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+    return client
@@ -0,0 +1,166 @@
+import os
+import numpy as np
+from assignment import travel_seconds_matrix
+from travel_matrix import haversine_meters
+
+VEHICLE_CAPACITY = int(os.getenv("POOL_CAPACITY", "3"))
+# Max in-car time as a multiple of the rider's direct trip, plus fixed slack
+DETOUR_FACTOR = float(os.getenv("POOL_DETOUR_FACTOR", "1.5"))
+DETOUR_SLACK_SECONDS = float(os.getenv("POOL_DETOUR_SLACK_SECONDS", "120"))
+# Rides are only pooled when both ends are this close to the seed ride's
+PICKUP_RADIUS_METERS = float(os.getenv("POOL_PICKUP_RADIUS_METERS", "400"))
+DESTINATION_RADIUS_METERS = float(os.getenv("POOL_DESTINATION_RADIUS_METERS", "800"))
+
+
+# ----------------------------
+# Route Planning
+# ----------------------------
+class RoutePlan:
+    """
+    Multi-stop plan for one vehicle. Node 0 is the driver's start; ride k
+    has its pickup at node 2k+1 and its dropoff at node 2k+2.
+    """
+
+    def __init__(self, start, rides, capacity=VEHICLE_CAPACITY):
+        self.start = start
+        self.rides = rides
+        self.capacity = capacity
+        points = [start] + [p for r in rides for p in (r["pickup"], r["destination"])]
+        coords = np.array([[float(p["lat"]), float(p["lon"])] for p in points])
+        self.times = travel_seconds_matrix(coords, coords)
+        self.direct = [self.times[2 * k + 1, 2 * k + 2] for k in range(len(rides))]
+        self.sequence = []  # node indices, excluding the start
+
+    def cost(self, sequence=None):
+        seq = self.sequence if sequence is None else sequence
+        nodes = [0] + seq
+        return float(sum(self.times[a, b] for a, b in zip(nodes, nodes[1:])))
+
+    def feasible(self, sequence):
+        """Pickup before dropoff, within capacity, and within every rider's detour budget"""
+        t = 0.0
+        load = 0
+        picked_at = {}
+        prev = 0
+        for node in sequence:
+            t += self.times[prev, node]
+            k, is_dropoff = divmod(node - 1, 2)
+            if not is_dropoff:
+                load += 1
+                if load > self.capacity:
+                    return False
+                picked_at[k] = t
+            else:
+                if k not in picked_at:
+                    return False
+                load -= 1
+                if t - picked_at[k] > DETOUR_FACTOR * self.direct[k] + DETOUR_SLACK_SECONDS:
+                    return False
+            prev = node
+        return True
+
+    def try_insert(self, k):
+        """Cheapest feasible insertion of ride k's pickup and dropoff; False if none"""
+        pickup, dropoff = 2 * k + 1, 2 * k + 2
+        best = None
+        n = len(self.sequence)
+        for i in range(n + 1):
+            for j in range(i, n + 1):
+                seq = self.sequence[:i] + [pickup] + self.sequence[i:j] + [dropoff] + self.sequence[j:]
+                if not self.feasible(seq):
+                    continue
+                c = self.cost(seq)
+                if best is None or c < best[0]:
+                    best = (c, seq)
+        if best is None:
+            return False
+        self.sequence = best[1]
+        return True
+
+    def two_opt(self):
+        """Reverse segments while that shortens the route and keeps it feasible"""
+        improved = True
+        best_cost = self.cost()
+        while improved:
+            improved = False
+            n = len(self.sequence)
+            for i in range(n - 1):
+                for j in range(i + 1, n):
+                    seq = self.sequence[:i] + self.sequence[i:j + 1][::-1] + self.sequence[j + 1:]
+                    c = self.cost(seq)
+                    if c + 1e-9 < best_cost and self.feasible(seq):
+                        self.sequence, best_cost = seq, c
+                        improved = True
+        return best_cost
+
+    def stops(self):
+        stops = []
+        for node in self.sequence:
+            k, is_dropoff = divmod(node - 1, 2)
+            ride = self.rides[k]
+            stops.append({
+                "type": "dropoff" if is_dropoff else "pickup",
+                "ride_id": ride["ride_id"],
+                "lat": float(ride["destination" if is_dropoff else "pickup"]["lat"]),
+                "lon": float(ride["destination" if is_dropoff else "pickup"]["lon"]),
+            })
+        return stops
+
+
+def plan_route(start, rides, capacity=VEHICLE_CAPACITY):
+    """Insertion + 2-opt plan serving rides in the given order of priority"""
+    plan = RoutePlan(start, rides, capacity)
+    for k in range(len(rides)):
+        if not plan.try_insert(k):
+            return None
+    plan.two_opt()
+    return plan
+
+
+# ----------------------------
+# Pool Formation
+# ----------------------------
+def _close(a, b, meters):
+    return float(haversine_meters(float(a["lat"]), float(a["lon"]), float(b["lat"]), float(b["lon"]))) <= meters
+
+
+def plan_pools(drivers, rides, capacity=VEHICLE_CAPACITY):
+    """
+    Group compatible waiting rides (FIFO seeds, nearby pickups and
+    destinations, within each rider's detour budget) and give each group
+    to the nearest available driver. Returns one dict per vehicle with the
+    driver, its rides and the ordered stops.
+    """
+    remaining = list(rides)
+    free_drivers = list(drivers)
+    plans = []
+    while remaining and free_drivers:
+        seed = remaining.pop(0)
+        starts = np.array([[float(d["lat"]), float(d["lon"])] for d in free_drivers])
+        pickup = np.array([[float(seed["pickup"]["lat"]), float(seed["pickup"]["lon"])]])
+        driver = free_drivers.pop(int(np.argmin(travel_seconds_matrix(starts, pickup)[:, 0])))
+        start = {"lat": driver["lat"], "lon": driver["lon"]}
+
+        group = [seed]
+        plan = plan_route(start, group, capacity)
+        for candidate in list(remaining):
+            if len(group) >= capacity:
+                break
+            if not (_close(seed["pickup"], candidate["pickup"], PICKUP_RADIUS_METERS)
+                    and _close(seed["destination"], candidate["destination"], DESTINATION_RADIUS_METERS)):
+                continue
+            candidate_plan = plan_route(start, group + [candidate], capacity)
+            if candidate_plan is not None:
+                group.append(candidate)
+                plan = candidate_plan
+                remaining.remove(candidate)
+
+        duration = plan.cost()
+        plans.append({
+            "driver": driver,
+            "rides": group,
+            "stops": plan.stops(),
+            "duration_seconds": duration,
+            "riders_per_hour": len(group) * 3600 / duration if duration else None,
+        })
+    return plans
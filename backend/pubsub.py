@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+BUS_KIND = os.getenv("RIDE_BUS", "local")
+BUS_SOCKET = os.getenv("RIDE_BUS_SOCKET", "/tmp/huskydrive-bus.sock")
+RECONNECT_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# In-Process Bus
+# ----------------------------
+class InProcessBus:
+    """Single-worker bus: publish delivers straight to this process's handler"""
+
+    def __init__(self):
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def publish(self, ride_id, event):
+        if self.handler is not None:
+            await self.handler(ride_id, event)
+
+    async def close(self):
+        self.handler = None
+
+
+# ----------------------------
+# Unix-Socket Bus
+# ----------------------------
+class UnixSocketBus:
+    """
+    Multi-worker bus over a local Unix-domain socket broker.
+
+    Every worker connects to the broker and receives every published event,
+    including its own. The broker is run by whichever worker binds the socket
+    first (or standalone via `python pubsub.py`); if it goes away, the
+    remaining workers reconnect and one of them takes over.
+    """
+
+    def __init__(self, path=BUS_SOCKET):
+        self.path = path
+        self.handler = None
+        self.server = None
+        self.broker_clients = set()
+        self.writer = None
+        self._reader_task = None
+        self._connected = None
+
+    async def start(self, handler):
+        self.handler = handler
+        self._connected = asyncio.Event()
+        self._reader_task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("Ride bus broker not reachable yet, retrying in background", extra={"path": self.path})
+
+    async def publish(self, ride_id, event):
+        frame = (json.dumps({"ride_id": ride_id, "event": event}) + "\n").encode("utf-8")
+        if self.writer is None:
+            # Broker down: deliver locally so this worker's sockets still update
+            await self._deliver(frame)
+            return
+        try:
+            self.writer.write(frame)
+            await self.writer.drain()
+        except (ConnectionError, OSError) as e:
+            logger.warning("Ride bus publish error", extra={"error": str(e)})
+            await self._deliver(frame)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        if self.server is not None:
+            self.server.close()
+            for client in list(self.broker_clients):
+                client.close()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await self._try_become_broker()
+                await asyncio.sleep(0.05)
+                continue
+            except OSError as e:
+                logger.warning("Ride bus connect error", extra={"error": str(e)})
+                await asyncio.sleep(RECONNECT_SECONDS)
+                continue
+
+            self._connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    await self._deliver(line)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                self.writer = None
+                self._connected.clear()
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _deliver(self, frame):
+        try:
+            data = json.loads(frame)
+            await self.handler(data["ride_id"], data["event"])
+        except Exception as e:
+            logger.error("Ride bus delivery error", extra={"error": repr(e)})
+
+    async def _try_become_broker(self):
+        if self.server is not None:
+            return
+        # Connection refused means a stale socket file from a dead broker
+        if os.path.exists(self.path) and not _socket_alive(self.path):
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        try:
+            self.server = await start_broker(self.path, self.broker_clients)
+        except OSError:
+            # Another worker won the race; connect to it instead
+            self.server = None
+
+
+def _socket_alive(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+async def start_broker(path, clients=None):
+    """Relay every newline-delimited frame to all connected workers"""
+    clients = clients if clients is not None else set()
+
+    async def handle(reader, writer):
+        clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for client in list(clients):
+                    try:
+                        client.write(line)
+                    except (ConnectionError, OSError):
+                        clients.discard(client)
+                await asyncio.gather(
+                    *(c.drain() for c in list(clients)), return_exceptions=True
+                )
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    return await asyncio.start_unix_server(handle, path=path)
+
+
+def create_bus(kind=BUS_KIND):
+    if kind == "unix":
+        return UnixSocketBus()
+    return InProcessBus()
+
+
+ride_bus = create_bus()
+
+
+if __name__ == "__main__":
+    # Standalone broker: python pubsub.py
+    async def serve():
+        if os.path.exists(BUS_SOCKET) and not _socket_alive(BUS_SOCKET):
+            os.unlink(BUS_SOCKET)
+        server = await start_broker(BUS_SOCKET)
+        print(f"Ride bus broker listening on {BUS_SOCKET}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
@@ -0,0 +1,129 @@
+import threading
+import time
+import numpy as np
+from db import get_candidate_drivers, calculate_route_minutes_seconds
+from queue_snapshot import queue_snapshot, SingleFlight
+from assignment import travel_seconds_matrix
+from changes import change_feed, DRIVER_MOVED
+
+# Driver pings alone refresh the snapshot at most this often
+POSITION_REFRESH_SECONDS = 5
+
+
+def route_seconds(origin, destination):
+    m, s = calculate_route_minutes_seconds(origin, destination)
+    return m * 60 + s
+
+
+# ----------------------------
+# Queue ETA Snapshot
+# ----------------------------
+class QueueEtaEngine(SingleFlight):
+    """
+    Cumulative pickup ETAs for every waiting ride, recomputed once per queue
+    mutation instead of once per client poll.
+
+    All available drivers drain the FIFO queue together: each ride goes to
+    the driver who can reach its pickup first, and each driver's chain of
+    legs is kept as a running (prefix) sum of seconds.
+
+    fetch_drivers(pickups) narrows the fleet to drivers near the waiting
+    pickups. Candidates are compared with one vectorized estimate matrix;
+    only the chosen leg and the fixed pickup -> destination legs are routed
+    live.
+    """
+
+    def __init__(self, fetch_rides, fetch_drivers, leg_seconds, estimate_seconds=travel_seconds_matrix):
+        self.fetch_rides = fetch_rides
+        self.fetch_drivers = fetch_drivers
+        self.leg_seconds = leg_seconds
+        self.estimate_seconds = estimate_seconds
+        self.entries = {}
+        self.has_drivers = False
+        self.built_at = 0.0
+        self._dirty = True
+        self._positions_dirty = False
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Queue changed (ride requested / accepted / completed)"""
+        self._dirty = True
+
+    def driver_moved(self):
+        """A driver position changed"""
+        self._positions_dirty = True
+
+    def on_change(self, change):
+        """Change feed subscriber"""
+        # Position-only moves are throttled; a driver joining or changing
+        # availability reshapes the queue at once
+        if change["kind"] == DRIVER_MOVED and "available" not in change and not change.get("joined"):
+            self.driver_moved()
+        else:
+            self.invalidate()
+
+    def _stale(self):
+        if self._dirty:
+            return True
+        return self._positions_dirty and time.time() - self.built_at >= POSITION_REFRESH_SECONDS
+
+    def get(self, ride_id):
+        """O(1) lookup of a waiting ride's snapshot entry, rebuilding first if stale"""
+        self._refresh()
+        return self.entries.get(ride_id)
+
+    def all(self):
+        """Every waiting ride's entry by ride_id, rebuilding first if stale"""
+        self._refresh()
+        return self.entries
+
+    def _rebuild(self):
+        self._dirty = False
+        self._positions_dirty = False
+        rides = self.fetch_rides()  # waiting rides, already in FIFO order
+        # Only drivers among the nearest to some pickup drain the queue
+        drivers = [d for d in self.fetch_drivers([r["pickup"] for r in rides]) if d.get("available", True)]
+
+        # Per-driver state: [elapsed seconds (prefix sum), current point]
+        chains = [
+            [0, {"lat": float(d["lat"]), "lon": float(d["lon"])}, d]
+            for d in drivers
+        ]
+        if chains and rides:
+            # A chain only ever sits at a driver's start or at a ride's destination, so
+            # every candidate leg is one row of this (drivers + rides) x rides estimate
+            starts = [c[1] for c in chains] + [r["destination"] for r in rides]
+            points = np.array([[float(p["lat"]), float(p["lon"])] for p in starts])
+            pickups = np.array([[float(r["pickup"]["lat"]), float(r["pickup"]["lon"])] for r in rides])
+            estimates = self.estimate_seconds(points, pickups)
+            elapsed = np.zeros(len(chains))
+            rows = np.arange(len(chains))  # estimate row of each chain's current point
+
+        entries = {}
+        for position, ride in enumerate(rides):
+            eta_seconds = None
+            if chains:
+                k = int(np.argmin(elapsed + estimates[rows, position]))
+                chain = chains[k]
+                eta_seconds = chain[0] + self.leg_seconds(chain[1], ride["pickup"])
+                chain[0] = eta_seconds + self.leg_seconds(ride["pickup"], ride["destination"])
+                elapsed[k], rows[k] = chain[0], len(chains) + position
+                chain[1] = ride["destination"]
+                driver = chain[2]
+            entries[ride["ride_id"]] = {
+                "queue_position": position + 1,
+                "eta_seconds": eta_seconds,
+                "driver_id": driver["driver_id"] if chains else None,
+                "driver_location": (
+                    {"lat": float(driver["lat"]), "lon": float(driver["lon"])} if chains else None
+                ),
+            }
+
+        self.entries = entries
+        self.has_drivers = bool(chains)
+        self.built_at = time.time()
+
+
+# Waiting rides come from the shared snapshot, so ETA rebuilds add no storage reads
+queue_eta = QueueEtaEngine(lambda: queue_snapshot.get()["queue"], get_candidate_drivers, route_seconds)
+change_feed.subscribe(queue_eta.on_change)
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+import orjson
+from dotenv import load_dotenv
+from db import get_rides_by_status
+from changes import change_feed, DRIVER_MOVED
+from queue_versions import queue_versions
+
+load_dotenv()
+
+# Upper bound on staleness for writes this worker never hears about
+MAX_AGE_SECONDS = float(os.getenv("QUEUE_SNAPSHOT_MAX_AGE_SECONDS", "15"))
+
+
+# ----------------------------
+# Single-Flight Rebuilds
+# ----------------------------
+class SingleFlight:
+    """
+    Rebuild-on-read for shared snapshots. Subclasses provide _stale(),
+    _rebuild() and a _lock; concurrent readers of a stale snapshot wait
+    for one rebuild instead of each running their own.
+    """
+
+    def _refresh(self):
+        if self._stale():
+            with self._lock:
+                # Readers that queued on the lock find the rebuild already done
+                if self._stale():
+                    self._rebuild()
+
+
+# ----------------------------
+# Queue Snapshot
+# ----------------------------
+class QueueSnapshot(SingleFlight):
+    """
+    The waiting queue and the rides in cars, read from storage at most once
+    per ride change (or per max_age) and shared by every driver dashboard.
+    The queue is also kept pre-serialized, so each response only encodes
+    the driver's own rides around it.
+    """
+
+    def __init__(self, fetch_rides, max_age=MAX_AGE_SECONDS):
+        self.fetch_rides = fetch_rides
+        self.max_age = max_age
+        # Replaced as a whole on rebuild, so a reader never sees a mix of two builds:
+        # {"version", "queue", "queue_json", "in_car": {ride_id: Ride}}
+        self.current = None
+        self.built_at = 0.0
+        self.rebuilds = 0
+        self.reads = 0
+        self._generation = 0  # bumped on every ride change
+        self._built_generation = -1
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """A ride was requested, accepted, completed or otherwise changed"""
+        self._generation += 1
+
+    def on_change(self, change):
+        """Change feed subscriber; driver moves leave both lists as they are"""
+        if change["kind"] != DRIVER_MOVED:
+            self.invalidate()
+
+    def _stale(self):
+        return self._built_generation != self._generation or time.time() - self.built_at >= self.max_age
+
+    def get(self):
+        """The current snapshot dict, rebuilding first if it is stale"""
+        self.reads += 1
+        self._refresh()
+        return self.current
+
+    def _rebuild(self):
+        # Changes landing mid-read bump the generation again and force another rebuild
+        generation = self._generation
+        queue = self.fetch_rides("waiting")
+        in_car = {ride["ride_id"]: ride for ride in self.fetch_rides("in_car")}
+        self.current = {
+            "version": queue_versions.record(queue),
+            "queue": queue,
+            "queue_json": orjson.dumps(queue),
+            "in_car": in_car,
+        }
+        self.built_at = time.time()
+        self._built_generation = generation
+        self.rebuilds += 1
+
+    def stats(self):
+        current = self.current or {"queue": [], "in_car": {}}
+        return {"reads": self.reads, "rebuilds": self.rebuilds,
+                "waiting": len(current["queue"]), "in_car": len(current["in_car"])}
+
+
+queue_snapshot = QueueSnapshot(get_rides_by_status)
+change_feed.subscribe(queue_snapshot.on_change)
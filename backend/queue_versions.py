@@ -0,0 +1,56 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+HISTORY_SIZE = 64
+
+
+# ----------------------------
+# Queue Versions
+# ----------------------------
+class QueueVersions:
+    """
+    Content-derived versions of the waiting queue, plus a short history of
+    recent versions so a client can be sent only what changed since the
+    version it last saw. Versions hash the ride ids in queue order, so every
+    worker computes the same version for the same queue.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history_size = history_size
+        self._history = OrderedDict()  # version -> tuple of ride ids
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def version_of(ride_ids):
+        digest = hashlib.sha1("\n".join(ride_ids).encode("utf-8")).hexdigest()
+        return digest[:16]
+
+    def record(self, rides):
+        """Version for this queue; remembers it for later deltas"""
+        ride_ids = tuple(r["ride_id"] for r in rides)
+        version = self.version_of(ride_ids)
+        with self._lock:
+            self._history[version] = ride_ids
+            self._history.move_to_end(version)
+            while len(self._history) > self.history_size:
+                self._history.popitem(last=False)
+        return version
+
+    def delta(self, since_version, rides):
+        """
+        (added rides, removed ride ids) relative to since_version, or None if
+        that version is unknown here and the client needs the full queue.
+        """
+        with self._lock:
+            before = self._history.get(since_version)
+        if before is None:
+            return None
+        before_ids = set(before)
+        current_ids = {r["ride_id"] for r in rides}
+        added = [r for r in rides if r["ride_id"] not in before_ids]
+        removed = [ride_id for ride_id in before if ride_id not in current_ids]
+        return added, removed
+
+
+queue_versions = QueueVersions()
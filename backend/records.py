@@ -0,0 +1,107 @@
+from dataclasses import dataclass, field, asdict
+from decimal import Decimal
+from typing import Optional
+
+
+def _float(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+# ----------------------------
+# Record Base
+# ----------------------------
+class _Record:
+    """
+    Read-only mapping-style access (record["lat"], record.get("lat")), so
+    code written against raw storage items works unchanged on records.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def __contains__(self, name):
+        # Storage items simply lack unset attributes
+        return getattr(self, name, None) is not None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+# ----------------------------
+# Records
+# ----------------------------
+# Built once at the storage boundary: Decimals become floats here, so
+# nothing downstream re-converts and responses serialize without walking
+# Decimals. Attributes not listed are dropped.
+@dataclass(slots=True)
+class Place(_Record):
+    lat: float
+    lon: float
+    address: Optional[str] = None
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(_float(item["lat"]), _float(item["lon"]), item.get("address"))
+
+
+@dataclass(slots=True)
+class Ride(_Record):
+    ride_id: str
+    name: Optional[str]
+    pickup: Place
+    destination: Place
+    status: str
+    notes: str = ""
+    timestamp: Optional[str] = None
+    driver_id: Optional[str] = None
+
+    @classmethod
+    def from_item(cls, item):
+        if item is None:
+            return None
+        return cls(
+            item["ride_id"],
+            item.get("name"),
+            Place.from_item(item["pickup"]),
+            Place.from_item(item["destination"]),
+            item["status"],
+            item.get("notes") or "",
+            item.get("timestamp"),
+            item.get("driver_id"),
+        )
+
+
+@dataclass(slots=True)
+class Driver(_Record):
+    driver_id: str
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    available: bool = True
+    current_ride_id: Optional[str] = None
+    active_ride_ids: list = field(default_factory=list)
+    route_stops: list = field(default_factory=list)
+    last_updated: Optional[str] = None
+
+    @classmethod
+    def from_item(cls, item):
+        if item is None:
+            return None
+        return cls(
+            item["driver_id"],
+            _float(item.get("lat")),
+            _float(item.get("lon")),
+            item.get("available", True),
+            item.get("current_ride_id"),
+            list(item.get("active_ride_ids") or []),
+            [dict(s) for s in item.get("route_stops") or []],
+            item.get("last_updated"),
+        )
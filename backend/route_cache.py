@@ -0,0 +1,131 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Route Duration Cache
+# ----------------------------
+class RouteCache:
+    """
+    LRU + TTL cache of route durations (in seconds) keyed on snapped
+    origin/destination coordinates.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=900, precision=4, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Number of decimal places coordinates are snapped to (4 ~= 11 m)
+        self.precision = precision
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def key(self, origin, destination):
+        p = self.precision
+        return (
+            round(float(origin["lat"]), p),
+            round(float(origin["lon"]), p),
+            round(float(destination["lat"]), p),
+            round(float(destination["lon"]), p),
+        )
+
+    def get(self, origin, destination):
+        """Return the cached duration in seconds, or None on a miss"""
+        key = self.key(origin, destination)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, origin, destination, duration_seconds):
+        key = self.key(origin, destination)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (int(duration_seconds), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def load(self):
+        """Load unexpired entries from disk, ignoring a missing or corrupt file"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Route cache load error", extra={"path": self.path, "error": str(e)})
+            return
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                key, duration, expires_at = tuple(row[0]), row[1], row[2]
+                if expires_at > now:
+                    self._entries[key] = (duration, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """Write unexpired entries to disk atomically"""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            rows = [[list(k), d, exp] for k, (d, exp) in self._entries.items() if exp > now]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Route cache save error", extra={"path": self.path, "error": str(e)})
+
+
+route_cache = RouteCache(
+    max_entries=int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=int(os.getenv("ROUTE_CACHE_TTL_SECONDS", "900")),
+    precision=int(os.getenv("ROUTE_CACHE_PRECISION", "4")),
+    path=os.getenv("ROUTE_CACHE_PATH") or None,
+)
+atexit.register(route_cache.save)
@@ -0,0 +1,204 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+from changes import change_feed, RIDE_ACCEPTED, RIDE_COMPLETED
+from db import calculate_route_geometry, get_ride_by_id, get_driver_by_id
+from spatial_index import METERS_PER_DEG_LAT
+from travel_matrix import estimate_route_seconds
+
+
+load_dotenv()
+
+# A driver this far from the tracked polyline is off-route and gets a fresh route
+OFF_ROUTE_METERS = float(os.getenv("OFF_ROUTE_METERS", "75"))
+# At most one route call per ride in this window; in between, off-route ETAs use the speed model
+REROUTE_MIN_SECONDS = float(os.getenv("REROUTE_MIN_SECONDS", "20"))
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Route Polyline
+# ----------------------------
+class RoutePolyline:
+    """
+    One fetched route: its vertices in local meters and the seconds spent
+    on each segment (each step's duration spread over its segments by
+    length). remaining_seconds() projects a position onto the nearest
+    segment and sums what is left, without another route call.
+    """
+
+    def __init__(self, line, steps, duration_seconds, pickup_vertex=None):
+        points = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+        self.lon0, self.lat0 = points[0]
+        self.meters_per_deg_lon = METERS_PER_DEG_LAT * np.cos(np.radians(self.lat0))
+        self.xy = self._to_xy(points[:, 1], points[:, 0])
+
+        self.segments = np.diff(self.xy, axis=0)
+        self.lengths = np.hypot(self.segments[:, 0], self.segments[:, 1])
+        self.seconds = self._segment_seconds(steps, duration_seconds)
+        # Seconds from the end of segment i to the destination
+        self.after = np.concatenate([np.cumsum(self.seconds[::-1])[::-1][1:], [0.0]])
+        self.progress = 0  # segment the driver was last matched to
+        self.pickup_vertex = pickup_vertex  # where the pickup leg ends, if the route has one
+        self.fetched_at = time.time()
+
+    def past_pickup(self):
+        return self.pickup_vertex is None or self.progress >= self.pickup_vertex
+
+    def _to_xy(self, lat, lon):
+        return np.stack([(lon - self.lon0) * self.meters_per_deg_lon, (lat - self.lat0) * METERS_PER_DEG_LAT], axis=-1)
+
+    def _segment_seconds(self, steps, duration_seconds):
+        count = len(self.lengths)
+        seconds = np.zeros(count)
+        offsets = [s.get("GeometryOffset") for s in steps]
+        if not steps or None in offsets:
+            spans = [(0, count, duration_seconds)]
+        else:
+            ends = offsets[1:] + [count]
+            spans = [(start, end, float(s["DurationSeconds"])) for s, start, end in zip(steps, offsets, ends)]
+        for start, end, duration in spans:
+            if end <= start:
+                continue
+            lengths = self.lengths[start:end]
+            total = lengths.sum()
+            seconds[start:end] = duration * (lengths / total if total else 1 / len(lengths))
+        return seconds
+
+    def remaining_seconds(self, lat, lon):
+        """(meters off the route, seconds left to the destination) for a position"""
+        point = self._to_xy(np.float64(lat), np.float64(lon))
+        if not len(self.lengths):
+            return float(np.hypot(*(point - self.xy[0]))), 0.0
+
+        # Only look from the last matched segment on, so a route that doubles
+        # back on itself does not snap the driver to the earlier pass
+        start = max(self.progress - 1, 0)
+        a, ab = self.xy[start:-1], self.segments[start:]
+        squared = np.maximum(self.lengths[start:] ** 2, 1e-9)
+        t = np.clip(np.einsum("ij,ij->i", point - a, ab) / squared, 0.0, 1.0)
+        offsets = a + ab * t[:, None] - point
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        i = int(np.argmin(distances))
+        self.progress = start + i
+        remaining = self.after[self.progress] + (1 - t[i]) * self.seconds[self.progress]
+        return float(distances[i]), float(remaining)
+
+
+# ----------------------------
+# Route Tracker
+# ----------------------------
+class RouteTracker:
+    """
+    In-car ETAs from a route fetched once per ride. The route is requested
+    (on a background thread) when the ride is accepted, through the pickup
+    to the destination; each status check then projects the driver onto it
+    locally. Only a driver more than off_route_meters from the polyline
+    triggers another route call.
+    """
+
+    def __init__(self, fetch_route, off_route_meters=OFF_ROUTE_METERS, reroute_min_seconds=REROUTE_MIN_SECONDS):
+        self.fetch_route = fetch_route
+        self.off_route_meters = off_route_meters
+        self.reroute_min_seconds = reroute_min_seconds
+        self.routes = {}  # ride_id -> RoutePolyline
+        self.attempted_at = {}  # ride_id -> time of the last route call
+        self.pickups = {}  # ride_id -> pickup, until the driver is matched past it
+        self.fetches = 0
+        self.projections = 0
+        self.estimates = 0
+        self._locks = {}  # ride_id -> Lock, so one ride never fetches twice at once
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="route")
+
+    def _ride_lock(self, ride_id):
+        with self._lock:
+            return self._locks.setdefault(ride_id, threading.Lock())
+
+    def _fetch(self, ride_id, origin, destination):
+        self.attempted_at[ride_id] = time.time()
+        self.fetches += 1
+        pickup = self.pickups.get(ride_id)
+        leg = self.fetch_route(origin, destination, [pickup] if pickup else [])
+        if leg is None:
+            return None
+        try:
+            pickup_vertex = leg["leg_ends"][0] if pickup else None
+            route = RoutePolyline(leg["line"], leg["steps"], leg["duration_seconds"], pickup_vertex)
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            logger.warning("Unusable route geometry", extra={"ride_id": ride_id, "error": str(e)})
+            return None
+        self.routes[ride_id] = route
+        return route
+
+    def start(self, ride_id, origin, destination, pickup=None):
+        """Fetch the ride's route (via pickup, if given) now unless one is already tracked"""
+        with self._ride_lock(ride_id):
+            if ride_id not in self.routes:
+                if pickup is not None:
+                    self.pickups[ride_id] = pickup
+                self._fetch(ride_id, origin, destination)
+
+    def eta_seconds(self, ride_id, position, destination):
+        """Seconds from the driver's position to the ride's destination"""
+        lat, lon = float(position["lat"]), float(position["lon"])
+        with self._ride_lock(ride_id):
+            route = self.routes.get(ride_id)
+            if route is not None:
+                off_route, remaining = route.remaining_seconds(lat, lon)
+                if route.past_pickup():
+                    # Reroutes from here on go straight to the destination
+                    self.pickups.pop(ride_id, None)
+                if off_route <= self.off_route_meters:
+                    self.projections += 1
+                    return int(round(remaining))
+
+            # No route yet, or the driver left it: reroute unless one was just tried
+            if time.time() - self.attempted_at.get(ride_id, 0.0) >= self.reroute_min_seconds:
+                route = self._fetch(ride_id, position, destination)
+                if route is not None:
+                    self.projections += 1
+                    return int(round(route.remaining_seconds(lat, lon)[1]))
+
+        self.estimates += 1
+        pickup = self.pickups.get(ride_id)
+        if pickup is not None:
+            return estimate_route_seconds(position, pickup) + estimate_route_seconds(pickup, destination)
+        return estimate_route_seconds(position, destination)
+
+    def forget(self, ride_id):
+        with self._lock:
+            self._locks.pop(ride_id, None)
+        self.routes.pop(ride_id, None)
+        self.attempted_at.pop(ride_id, None)
+        self.pickups.pop(ride_id, None)
+
+    def start_for_ride(self, ride_id, driver_id):
+        ride, driver = get_ride_by_id(ride_id), get_driver_by_id(driver_id)
+        if ride and ride.get("status") == "in_car" and driver and "lat" in driver:
+            self.start(ride_id, {"lat": driver["lat"], "lon": driver["lon"]}, ride["destination"], ride["pickup"])
+
+    def on_change(self, change):
+        """Change feed subscriber: fetch on accept, drop on completion"""
+        if change["kind"] == RIDE_ACCEPTED:
+            self._executor.submit(self.start_for_ride, change["ride_id"], change["driver_id"])
+        elif change["kind"] == RIDE_COMPLETED:
+            self.forget(change["ride_id"])
+
+    def stats(self):
+        return {
+            "rides": len(self.routes),
+            "route_calls": self.fetches,
+            "projections": self.projections,
+            "estimates": self.estimates,
+        }
+
+
+route_tracker = RouteTracker(calculate_route_geometry)
+change_feed.subscribe(route_tracker.on_change)
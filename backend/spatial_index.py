@@ -0,0 +1,224 @@
+import math
+import os
+import threading
+import time
+
+CELL_METERS = float(os.getenv("DRIVER_INDEX_CELL_METERS", "250"))
+# Re-seed from storage this often, picking up drivers seen by other workers
+REFRESH_SECONDS = float(os.getenv("DRIVER_INDEX_REFRESH_SECONDS", "60"))
+
+METERS_PER_DEG_LAT = 111320.0
+REFERENCE_LAT = 47.655  # UW campus
+
+
+def approx_meters(lat1, lon1, lat2, lon2):
+    """Equirectangular distance, accurate to well under 1% at campus scale"""
+    x = (lon2 - lon1) * METERS_PER_DEG_LAT * math.cos(math.radians((lat1 + lat2) / 2))
+    y = (lat2 - lat1) * METERS_PER_DEG_LAT
+    return math.hypot(x, y)
+
+
+# ----------------------------
+# Driver Grid Index
+# ----------------------------
+class DriverGridIndex:
+    """
+    Uniform lat/lon grid of live driver positions.
+    Supports k-nearest and within-radius queries by searching rings of cells
+    outward from the query point.
+    """
+
+    def __init__(self, loader=None, cell_meters=CELL_METERS, refresh_seconds=REFRESH_SECONDS):
+        self.loader = loader  # returns iterable of driver items to (re)seed from
+        self.refresh_seconds = refresh_seconds
+        self.lat_step = cell_meters / METERS_PER_DEG_LAT
+        self.lon_step = cell_meters / (METERS_PER_DEG_LAT * math.cos(math.radians(REFERENCE_LAT)))
+        self.cell_meters = cell_meters
+        self.drivers = {}  # driver_id -> [lat, lon, available, cell]
+        self.cells = {}  # cell -> set of driver_id
+        self.seeded_at = None
+        self._changed = None  # driver ids touched while a reload reads storage
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.lat_step), math.floor(lon / self.lon_step))
+
+    def upsert(self, driver_id, lat, lon, available=None):
+        """Move (or add) a driver; True if it is new here or its availability flipped"""
+        lat, lon = float(lat), float(lon)
+        cell = self._cell(lat, lon)
+        with self._lock:
+            self._touch(driver_id)
+            entry = self.drivers.get(driver_id)
+            if entry is None:
+                entry = [lat, lon, True if available is None else available, cell]
+                self.drivers[driver_id] = entry
+                reshaped = True
+            else:
+                if entry[3] != cell:
+                    self._unlink(driver_id, entry[3])
+                entry[0], entry[1], entry[3] = lat, lon, cell
+                reshaped = available is not None and entry[2] != available
+                if available is not None:
+                    entry[2] = available
+            self.cells.setdefault(cell, set()).add(driver_id)
+        return reshaped
+
+    def set_available(self, driver_id, available):
+        with self._lock:
+            self._touch(driver_id)
+            entry = self.drivers.get(driver_id)
+            if entry is not None:
+                entry[2] = available
+
+    def remove(self, driver_id):
+        with self._lock:
+            self._touch(driver_id)
+            entry = self.drivers.pop(driver_id, None)
+            if entry is not None:
+                self._unlink(driver_id, entry[3])
+
+    def _touch(self, driver_id):
+        if self._changed is not None:
+            self._changed.add(driver_id)
+
+    def _unlink(self, driver_id, cell, cells=None):
+        cells = self.cells if cells is None else cells
+        members = cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del cells[cell]
+
+    def seed(self, drivers, keep=()):
+        """
+        Replace the index with these driver items. The new grid is built
+        without the lock; entries for driver ids in keep (updated live while
+        the items were being read) are carried over from the current grid.
+        """
+        self._swap(*self._build(drivers), keep)
+
+    def _build(self, drivers):
+        # One pass over the items, so a streaming scan is never held in memory
+        entries, cells = {}, {}
+        for d in drivers:
+            if "lat" in d and "lon" in d:
+                lat, lon = float(d["lat"]), float(d["lon"])
+                cell = self._cell(lat, lon)
+                entries[d["driver_id"]] = [lat, lon, d.get("available", True), cell]
+                cells.setdefault(cell, set()).add(d["driver_id"])
+        return entries, cells
+
+    def _swap(self, entries, cells, keep):
+        with self._lock:
+            for driver_id in keep:
+                stale = entries.pop(driver_id, None)
+                if stale is not None:
+                    self._unlink(driver_id, stale[3], cells)
+                entry = self.drivers.get(driver_id)
+                if entry is not None:
+                    entries[driver_id] = entry
+                    cells.setdefault(entry[3], set()).add(driver_id)
+            self.drivers, self.cells = entries, cells
+            self.seeded_at = time.time()
+
+    def _due(self):
+        return self.seeded_at is None or time.time() - self.seeded_at >= self.refresh_seconds
+
+    def ensure_fresh(self):
+        if self.loader is None or not self._due():
+            return
+        # Once seeded, queries keep using the current grid while one thread reloads
+        if not self._refresh_lock.acquire(blocking=self.seeded_at is None):
+            return
+        try:
+            if not self._due():
+                return
+            # The loader is a storage scan: never run it under _lock, which pings take on the event loop
+            with self._lock:
+                self._changed = set()
+            try:
+                grid = self._build(self.loader())
+            finally:
+                with self._lock:
+                    changed, self._changed = self._changed, None
+            self._swap(*grid, changed)
+        finally:
+            self._refresh_lock.release()
+
+    # ----------------------------
+    # Queries
+    # ----------------------------
+    def _ring(self, center, r):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def nearest(self, lat, lon, k=1, available_only=True, max_meters=None):
+        """Up to k (distance_meters, driver) pairs, closest first"""
+        self.ensure_fresh()
+        lat, lon = float(lat), float(lon)
+        center = self._cell(lat, lon)
+        found = []
+        with self._lock:
+            if not self.drivers:
+                return []
+            max_ring = self._max_ring(center, max_meters)
+            # Rings visit (2r + 1)^2 cells; once that outgrows the driver count,
+            # checking every driver is cheaper than walking empty cells
+            rings = min(max_ring, (math.isqrt(len(self.drivers)) + 1) // 2)
+            done = False
+            for r in range(rings + 1):
+                for cell in self._ring(center, r):
+                    for driver_id in self.cells.get(cell, ()):
+                        d_lat, d_lon, available, _ = self.drivers[driver_id]
+                        if available_only and not available:
+                            continue
+                        found.append((approx_meters(lat, lon, d_lat, d_lon), driver_id))
+                # Everything outside ring r is at least r cells away
+                if len(found) >= k:
+                    found.sort()
+                    if found[k - 1][0] <= r * self.cell_meters:
+                        done = True
+                        break
+            if not done and rings < max_ring:
+                found = [
+                    (approx_meters(lat, lon, e[0], e[1]), driver_id)
+                    for driver_id, e in self.drivers.items()
+                    if e[2] or not available_only
+                ]
+            found.sort()
+            results = []
+            for meters, driver_id in found[:k]:
+                if max_meters is not None and meters > max_meters:
+                    break
+                results.append((meters, self._as_item(driver_id)))
+            return results
+
+    def within_radius(self, lat, lon, meters, available_only=True):
+        """All (distance_meters, driver) pairs within meters, closest first"""
+        return self.nearest(lat, lon, k=len(self.drivers) or 1, available_only=available_only, max_meters=meters)
+
+    def available(self):
+        self.ensure_fresh()
+        with self._lock:
+            return [self._as_item(driver_id) for driver_id, e in self.drivers.items() if e[2]]
+
+    def _max_ring(self, center, max_meters):
+        if max_meters is not None:
+            return int(math.ceil(max_meters / self.cell_meters)) + 1
+        # Far enough to reach every occupied cell
+        ci, cj = center
+        return max(max(abs(i - ci), abs(j - cj)) for i, j in self.cells)
+
+    def _as_item(self, driver_id):
+        lat, lon, available, _ = self.drivers[driver_id]
+        return {"driver_id": driver_id, "lat": lat, "lon": lon, "available": available}
@@ -0,0 +1,526 @@
+import copy
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from metrics import instrument_boto_client
+
+
+load_dotenv()
+
+# dynamodb | sqlite | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "dynamodb")
+SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "huskydrive.sqlite3")
+# Rows per query when the SQLite store streams a table
+SQLITE_SCAN_PAGE_SIZE = int(os.getenv("STORAGE_SQLITE_SCAN_PAGE_SIZE", "500"))
+
+# Partition key of each table
+KEYS = {"rides": "ride_id", "drivers": "driver_id"}
+
+# GSI on Rides: partition by status, sorted by request timestamp (FIFO queue order)
+RIDES_STATUS_INDEX = os.getenv("DYNAMO_RIDES_STATUS_INDEX", "status-timestamp-index")
+RIDES_STATUS_INDEX_DEFINITION = {
+    "IndexName": RIDES_STATUS_INDEX,
+    "KeySchema": [
+        {"AttributeName": "status", "KeyType": "HASH"},
+        {"AttributeName": "timestamp", "KeyType": "RANGE"},
+    ],
+    "Projection": {"ProjectionType": "ALL"},
+}
+
+_MISSING = object()
+
+
+class RideConflictError(Exception):
+    """A conditional ride/driver transition failed (e.g. the ride was already taken)"""
+
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index  # position of the transaction item whose condition failed
+
+
+# ----------------------------
+# Conditions and Updates
+# ----------------------------
+class Condition:
+    """
+    Precondition on a stored item. DynamoDB renders it to a condition
+    expression; the local backends evaluate it against the item.
+    Combine with & and |.
+    """
+
+    def __and__(self, other):
+        return AllOf(self, other)
+
+    def __or__(self, other):
+        return AnyOf(self, other)
+
+
+class Equals(Condition):
+    def __init__(self, attr, value):
+        self.attr, self.value = attr, value
+
+    def render(self, expr):
+        return f"{expr.name(self.attr)} = {expr.value(self.value)}"
+
+    def test(self, item):
+        return item.get(self.attr, _MISSING) == self.value
+
+
+class Exists(Condition):
+    def __init__(self, attr):
+        self.attr = attr
+
+    def render(self, expr):
+        return f"attribute_exists({expr.name(self.attr)})"
+
+    def test(self, item):
+        return self.attr in item
+
+
+class Missing(Condition):
+    def __init__(self, attr):
+        self.attr = attr
+
+    def render(self, expr):
+        return f"attribute_not_exists({expr.name(self.attr)})"
+
+    def test(self, item):
+        return self.attr not in item
+
+
+class SizeAtMost(Condition):
+    def __init__(self, attr, size):
+        self.attr, self.size = attr, size
+
+    def render(self, expr):
+        return f"size({expr.name(self.attr)}) <= {expr.value(self.size)}"
+
+    def test(self, item):
+        return self.attr in item and len(item[self.attr]) <= self.size
+
+
+class AllOf(Condition):
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def render(self, expr):
+        return "(" + " AND ".join(c.render(expr) for c in self.conditions) + ")"
+
+    def test(self, item):
+        return all(c.test(item) for c in self.conditions)
+
+
+class AnyOf(Condition):
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def render(self, expr):
+        return "(" + " OR ".join(c.render(expr) for c in self.conditions) + ")"
+
+    def test(self, item):
+        return any(c.test(item) for c in self.conditions)
+
+
+class Update:
+    """Set fields on one item (creating it if absent), optionally guarded by a condition"""
+
+    def __init__(self, table, key, fields, condition=None):
+        self.table = table
+        self.key = key
+        self.fields = fields
+        self.condition = condition
+
+
+class _Expression:
+    """Placeholder allocator for one DynamoDB request (every name aliased, so reserved words are safe)"""
+
+    def __init__(self):
+        self.names = {}
+        self.values = {}
+
+    def name(self, attr):
+        placeholder = f"#n{len(self.names)}"
+        self.names[placeholder] = attr
+        return placeholder
+
+    def value(self, value):
+        placeholder = f":v{len(self.values)}"
+        self.values[placeholder] = value
+        return placeholder
+
+    def update_kwargs(self, fields, condition=None):
+        kwargs = {"UpdateExpression": "SET " + ", ".join(
+            f"{self.name(attr)} = {self.value(value)}" for attr, value in fields.items()
+        )}
+        if condition is not None:
+            kwargs["ConditionExpression"] = condition.render(self)
+        kwargs["ExpressionAttributeNames"] = self.names
+        if self.values:
+            kwargs["ExpressionAttributeValues"] = self.values
+        return kwargs
+
+
+# ----------------------------
+# Streaming Scans
+# ----------------------------
+def scan_items(table, limit=None, page_size=None, **scan_kwargs):
+    """
+    Yield every item of a table across all scan pages.
+    Only one page is held in memory; stops early once limit items are yielded.
+    """
+    kwargs = dict(scan_kwargs)
+    if page_size:
+        kwargs["Limit"] = page_size
+    yielded = 0
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get("Items", []):
+            yield item
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def parallel_scan_items(table, segments=4, limit=None, max_buffered_pages=8, **scan_kwargs):
+    """
+    Yield every item of a table using DynamoDB parallel scan segments on a
+    thread pool. Pages are handed over through a bounded queue, so workers
+    block instead of buffering the whole table. Item order is not defined.
+    """
+    pages = queue.Queue(maxsize=max_buffered_pages)
+    stop = threading.Event()
+    done_marker = object()
+
+    def scan_segment(segment):
+        try:
+            kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=segments)
+            while not stop.is_set():
+                response = table.scan(**kwargs)
+                _put(response.get("Items", []))
+                if "LastEvaluatedKey" not in response:
+                    break
+                kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as e:
+            _put(e)
+        finally:
+            _put(done_marker)
+
+    def _put(value):
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    executor = ThreadPoolExecutor(max_workers=segments)
+    for segment in range(segments):
+        executor.submit(scan_segment, segment)
+
+    try:
+        finished = 0
+        yielded = 0
+        while finished < segments:
+            page = pages.get()
+            if page is done_marker:
+                finished += 1
+                continue
+            if isinstance(page, Exception):
+                raise page
+            for item in page:
+                yield item
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+    finally:
+        # Early exit (limit, error or abandoned generator): release blocked workers
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+# ----------------------------
+# DynamoDB Backend
+# ----------------------------
+class DynamoStore:
+    """Rides and Drivers tables in DynamoDB; the production backend"""
+
+    def __init__(self, rides_table, drivers_table, client):
+        self.tables = {"rides": rides_table, "drivers": drivers_table}
+        self.client = client
+
+    def get(self, table, key):
+        response = self.tables[table].get_item(Key={KEYS[table]: key})
+        return response.get("Item")
+
+    def put(self, table, item):
+        self.tables[table].put_item(Item=item)
+
+    def update(self, table, key, fields):
+        self.tables[table].update_item(Key={KEYS[table]: key}, **_Expression().update_kwargs(fields))
+
+    def scan(self, table, limit=None, segments=None):
+        """Yield every item of a table; segments > 1 reads with a parallel scan (unordered)"""
+        if segments and segments > 1:
+            return parallel_scan_items(self.tables[table], segments=segments, limit=limit)
+        return scan_items(self.tables[table], limit=limit)
+
+    def rides_by_status(self, status):
+        """Rides with the given status in FIFO (timestamp) order, via the status index"""
+        items = []
+        kwargs = {
+            "IndexName": RIDES_STATUS_INDEX,
+            "KeyConditionExpression": Key("status").eq(status),
+            "ScanIndexForward": True,
+        }
+        while True:
+            response = self.tables["rides"].query(**kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def transact(self, updates, reasons):
+        """
+        One TransactWriteItems round trip. If a condition fails, raise
+        RideConflictError with the matching entry from reasons.
+        """
+        items = [{"Update": dict(
+            TableName=self.tables[u.table].name,
+            Key={KEYS[u.table]: u.key},
+            **_Expression().update_kwargs(u.fields, u.condition)
+        )} for u in updates]
+        try:
+            self.client.transact_write_items(TransactItems=items)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            codes = [r.get("Code") for r in e.response.get("CancellationReasons", [])]
+            for index, code in enumerate(codes):
+                if code == "ConditionalCheckFailed":
+                    raise RideConflictError(reasons[index], index) from e
+            raise RideConflictError("Ride changed concurrently, try again") from e
+
+    def create_rides_status_index(self):
+        """One-time setup: add the status/timestamp GSI to an existing Rides table"""
+        rides_table = self.tables["rides"]
+        rides_table.meta.client.update_table(
+            TableName=rides_table.name,
+            AttributeDefinitions=[
+                {"AttributeName": "status", "AttributeType": "S"},
+                {"AttributeName": "timestamp", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexUpdates=[{"Create": RIDES_STATUS_INDEX_DEFINITION}],
+        )
+
+
+# ----------------------------
+# In-Memory Backend
+# ----------------------------
+class MemoryStore:
+    """
+    Process-local dicts with a status index; for tests, benchmarks and
+    single-worker demos. Items are copied in and out like a real store.
+    """
+
+    def __init__(self):
+        self.tables = {"rides": {}, "drivers": {}}
+        self.by_status = {}  # status -> set of ride ids
+        self._lock = threading.RLock()
+
+    def get(self, table, key):
+        with self._lock:
+            item = self.tables[table].get(key)
+            return copy.deepcopy(item) if item is not None else None
+
+    def put(self, table, item):
+        with self._lock:
+            self._store(table, item[KEYS[table]], copy.deepcopy(item))
+
+    def update(self, table, key, fields):
+        with self._lock:
+            self._apply(Update(table, key, fields))
+
+    def scan(self, table, limit=None, segments=None):
+        # segments only applies to DynamoDB. Stored items are replaced, never
+        # mutated, so copying them lazily after the lock is released is safe
+        with self._lock:
+            items = list(self.tables[table].values())[:limit]
+        for item in items:
+            yield copy.deepcopy(item)
+
+    def rides_by_status(self, status):
+        with self._lock:
+            rides = [self.tables["rides"][r] for r in self.by_status.get(status, ())]
+            rides = [copy.deepcopy(r) for r in rides if "timestamp" in r]
+        rides.sort(key=lambda r: (r["timestamp"], r["ride_id"]))
+        return rides
+
+    def transact(self, updates, reasons):
+        with self._lock:
+            for index, u in enumerate(updates):
+                if u.condition is not None and not u.condition.test(self.tables[u.table].get(u.key, {})):
+                    raise RideConflictError(reasons[index], index)
+            for u in updates:
+                self._apply(u)
+
+    def _apply(self, u):
+        item = dict(self.tables[u.table].get(u.key) or {KEYS[u.table]: u.key})
+        item.update(copy.deepcopy(u.fields))
+        self._store(u.table, u.key, item)
+
+    def _store(self, table, key, item):
+        if table == "rides":
+            old = self.tables[table].get(key)
+            if old is not None:
+                self.by_status.get(old.get("status"), set()).discard(key)
+            self.by_status.setdefault(item.get("status"), set()).add(key)
+        self.tables[table][key] = item
+
+
+# ----------------------------
+# SQLite Backend
+# ----------------------------
+def _encode(item):
+    return json.dumps(item, default=float)
+
+
+def _decode(text):
+    # Numbers come back as Decimal, as they do from DynamoDB
+    return json.loads(text, parse_float=Decimal)
+
+
+class SqliteStore:
+    """
+    Items as JSON rows in a local SQLite file (WAL), with an indexed
+    status/timestamp column pair for the queue. Conditional transactions
+    run under BEGIN IMMEDIATE, so they stay atomic across worker processes
+    sharing the file.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rides (
+                ride_id TEXT PRIMARY KEY,
+                status TEXT,
+                timestamp TEXT,
+                item TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS rides_status_timestamp ON rides (status, timestamp);
+            CREATE TABLE IF NOT EXISTS drivers (
+                driver_id TEXT PRIMARY KEY,
+                item TEXT NOT NULL
+            );
+            """
+        )
+
+    def get(self, table, key):
+        with self._lock:
+            return self._get(table, key)
+
+    def put(self, table, item):
+        with self._lock:
+            self._write(table, item)
+
+    def update(self, table, key, fields):
+        self.transact([Update(table, key, fields)], [None])
+
+    def scan(self, table, limit=None, segments=None):
+        # segments only applies to DynamoDB. Pages by key, so the lock is only
+        # held per page and a stopped consumer reads no further
+        key, last, yielded = KEYS[table], "", 0
+        while limit is None or yielded < limit:
+            page = SQLITE_SCAN_PAGE_SIZE if limit is None else min(SQLITE_SCAN_PAGE_SIZE, limit - yielded)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {key}, item FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?", (last, page)
+                ).fetchall()
+            for last, item in rows:
+                yield _decode(item)
+            yielded += len(rows)
+            if len(rows) < page:
+                return
+
+    def rides_by_status(self, status):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item FROM rides WHERE status = ? AND timestamp IS NOT NULL ORDER BY timestamp, ride_id",
+                (status,),
+            ).fetchall()
+        return [_decode(row[0]) for row in rows]
+
+    def transact(self, updates, reasons):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                items = []
+                for index, u in enumerate(updates):
+                    item = self._get(u.table, u.key)
+                    if u.condition is not None and not u.condition.test(item or {}):
+                        raise RideConflictError(reasons[index], index)
+                    item = dict(item or {KEYS[u.table]: u.key}, **u.fields)
+                    items.append((u.table, item))
+                for table, item in items:
+                    self._write(table, item)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _get(self, table, key):
+        row = self._conn.execute(f"SELECT item FROM {table} WHERE {KEYS[table]} = ?", (key,)).fetchone()
+        return _decode(row[0]) if row else None
+
+    def _write(self, table, item):
+        if table == "rides":
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rides (ride_id, status, timestamp, item) VALUES (?, ?, ?, ?)",
+                (item["ride_id"], item.get("status"), item.get("timestamp"), _encode(item)),
+            )
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO drivers (driver_id, item) VALUES (?, ?)",
+                (item["driver_id"], _encode(item)),
+            )
+
+
+# ----------------------------
+# Backend Selection
+# ----------------------------
+def create_store(kind=STORAGE_BACKEND, aws_config=None):
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "sqlite":
+        return SqliteStore()
+    if kind != "dynamodb":
+        raise ValueError(f"Unknown STORAGE_BACKEND {kind!r} (expected dynamodb, sqlite or memory)")
+    dynamodb = boto3.resource(
+        "dynamodb",
+        region_name=os.getenv("AWS_REGION", "us-west-2"),
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        config=aws_config
+    )
+    # Item reads / writes, queue queries and transactions per operation, for /metrics
+    instrument_boto_client(dynamodb.meta.client)
+    return DynamoStore(
+        dynamodb.Table(os.getenv("DYNAMO_RIDES_TABLE", "Rides")),
+        dynamodb.Table(os.getenv("DYNAMO_DRIVERS_TABLE", "Drivers")),
+        dynamodb.meta.client,
+    )
@@ -0,0 +1,299 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from changes import change_feed, DRIVER_MOVED
+from travel_matrix import haversine_meters
+
+
+load_dotenv()
+
+# 64 points per block x 32 blocks = 2048 points (~2.8 h of 5 s pings) per driver
+BLOCK_POINTS = int(os.getenv("TRAJECTORY_BLOCK_POINTS", "64"))
+MAX_BLOCKS = int(os.getenv("TRAJECTORY_MAX_BLOCKS", "32"))
+SPILL_DIR = os.getenv("TRAJECTORY_SPILL_DIR", "trajectories")
+SPILL_INTERVAL_SECONDS = float(os.getenv("TRAJECTORY_SPILL_INTERVAL_SECONDS", "300"))
+
+# Fixed-point units: 0.1 s and 1e-6 degree (~0.1 m)
+TIME_SCALE = 10
+COORD_SCALE = 1_000_000
+DELTA_MIN, DELTA_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Per-Driver Track
+# ----------------------------
+class Track:
+    """
+    Fixed-size ring of blocks. Each block holds one absolute keyframe
+    (int64 time, lat, lon) and up to BLOCK_POINTS - 1 int16 deltas from the
+    previous point; a gap too large for int16 starts a new block. When the
+    ring is full the oldest block is overwritten, so memory never grows.
+    """
+
+    __slots__ = ("keys", "deltas", "counts", "spilled", "head", "size", "last")
+
+    def __init__(self, block_points=BLOCK_POINTS, max_blocks=MAX_BLOCKS):
+        self.keys = np.zeros((max_blocks, 3), np.int64)
+        self.deltas = np.zeros((max_blocks, block_points - 1, 3), np.int16)
+        self.counts = np.zeros(max_blocks, np.int32)
+        self.spilled = np.zeros(max_blocks, bool)
+        self.head = -1  # block being appended to
+        self.size = 0  # blocks in use
+        self.last = None  # last point, fixed-point
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.deltas.nbytes + self.counts.nbytes + self.spilled.nbytes
+
+    def append(self, point):
+        """Add a fixed-point (t, lat, lon); returns an evicted unspilled block, if any"""
+        if self.last is not None and self.counts[self.head] <= self.deltas.shape[1]:
+            delta = [point[i] - self.last[i] for i in range(3)]
+            if delta[0] >= 0 and all(DELTA_MIN <= d <= DELTA_MAX for d in delta):
+                self.deltas[self.head, self.counts[self.head] - 1] = delta
+                self.counts[self.head] += 1
+                self.last = point
+                return None
+        return self._start_block(point)
+
+    def _start_block(self, point):
+        max_blocks = len(self.counts)
+        self.head = (self.head + 1) % max_blocks
+        evicted = None
+        if self.size == max_blocks:
+            if not self.spilled[self.head]:
+                evicted = self.block(self.head)
+        else:
+            self.size += 1
+        self.keys[self.head] = point
+        self.counts[self.head] = 1
+        self.spilled[self.head] = False
+        self.last = point
+        return evicted
+
+    def block(self, b):
+        """(key, deltas, count) copy of block b, in the encoded form"""
+        return self.keys[b].copy(), self.deltas[b].copy(), int(self.counts[b])
+
+    def order(self):
+        """Block indices, oldest first"""
+        max_blocks = len(self.counts)
+        return [(self.head - self.size + 1 + i) % max_blocks for i in range(self.size)]
+
+    def points(self):
+        """All points as a fixed-point (n, 3) int64 array, oldest first"""
+        if not self.size:
+            return np.empty((0, 3), np.int64)
+        return np.concatenate([decode_block(*self.block(b)) for b in self.order()])
+
+
+def decode_block(key, deltas, count):
+    points = np.empty((count, 3), np.int64)
+    points[0] = key
+    if count > 1:
+        points[1:] = key + np.cumsum(deltas[:count - 1].astype(np.int64), axis=0)
+    return points
+
+
+def _to_fixed(t, lat, lon):
+    return (int(round(t * TIME_SCALE)), int(round(float(lat) * COORD_SCALE)), int(round(float(lon) * COORD_SCALE)))
+
+
+def _in_range(points, start, end):
+    mask = np.ones(len(points), bool)
+    if start is not None:
+        mask &= points[:, 0] >= start * TIME_SCALE
+    if end is not None:
+        mask &= points[:, 0] <= end * TIME_SCALE
+    return points[mask]
+
+
+def _as_dicts(points):
+    return [
+        {"t": t / TIME_SCALE, "lat": lat / COORD_SCALE, "lon": lon / COORD_SCALE}
+        for t, lat, lon in points.tolist()
+    ]
+
+
+# ----------------------------
+# Trajectory Store
+# ----------------------------
+class TrajectoryStore:
+    """
+    Position history for every driver, for replay, dispute resolution and
+    speed estimates. Tracks are memory-bounded rings; sealed blocks are
+    periodically spilled, still delta-encoded, to compressed .npz files.
+    """
+
+    def __init__(self, spill_dir=SPILL_DIR, interval=SPILL_INTERVAL_SECONDS,
+                 block_points=BLOCK_POINTS, max_blocks=MAX_BLOCKS):
+        self.spill_dir = spill_dir
+        self.interval = interval
+        self.block_points = block_points
+        self.max_blocks = max_blocks
+        self.tracks = {}  # driver_id -> Track
+        self.evicted = []  # (driver_id, key, deltas, count) overwritten before a spill
+        self.points = 0
+        self.spills = 0
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, driver_id, lat, lon, t=None):
+        point = _to_fixed(time.time() if t is None else t, lat, lon)
+        with self._lock:
+            track = self.tracks.get(driver_id)
+            if track is None:
+                track = self.tracks[driver_id] = Track(self.block_points, self.max_blocks)
+            evicted = track.append(point)
+            if evicted is not None and self.spill_dir:
+                self.evicted.append((driver_id,) + evicted)
+            self.points += 1
+        self._ensure_started()
+
+    def on_change(self, change):
+        """Change feed subscriber"""
+        if change["kind"] == DRIVER_MOVED:
+            self.record(change["driver_id"], change["lat"], change["lon"], change["at"])
+
+    def query(self, driver_id, start=None, end=None, include_spilled=False):
+        """Points with start <= t <= end (unix seconds) as [{"t", "lat", "lon"}], oldest first"""
+        with self._lock:
+            track = self.tracks.get(driver_id)
+            points = track.points() if track is not None else np.empty((0, 3), np.int64)
+        if include_spilled and self.spill_dir:
+            # Spilled blocks can still be in memory; only take what is older
+            before = points[0, 0] / TIME_SCALE if len(points) else None
+            older = self._read_spilled(driver_id, start, end)
+            if before is not None:
+                older = older[older[:, 0] < before * TIME_SCALE]
+            points = np.concatenate([older, points])
+        return _as_dicts(_in_range(points, start, end))
+
+    def speed_mps(self, driver_id, window_seconds=60):
+        """Average ground speed over the last window_seconds, or None without two points"""
+        with self._lock:
+            track = self.tracks.get(driver_id)
+            points = track.points() if track is not None else np.empty((0, 3), np.int64)
+        points = points[points[:, 0] >= points[-1, 0] - window_seconds * TIME_SCALE] if len(points) else points
+        if len(points) < 2:
+            return None
+        lat, lon = points[:, 1] / COORD_SCALE, points[:, 2] / COORD_SCALE
+        meters = float(np.sum(haversine_meters(lat[:-1], lon[:-1], lat[1:], lon[1:])))
+        seconds = (points[-1, 0] - points[0, 0]) / TIME_SCALE
+        return meters / seconds if seconds else None
+
+    # ----------------------------
+    # Spill
+    # ----------------------------
+    def spill(self, include_open=False):
+        """
+        Write sealed, not yet spilled blocks (plus any evicted early) to one
+        compressed file. include_open also writes each driver's current
+        block, for shutdown. Returns the file path, or None if nothing to write.
+        """
+        if not self.spill_dir:
+            return None
+        with self._spill_lock:
+            with self._lock:
+                blocks = self.evicted
+                self.evicted = []
+                for driver_id, track in self.tracks.items():
+                    for b in track.order():
+                        if not track.spilled[b] and (include_open or b != track.head):
+                            blocks.append((driver_id,) + track.block(b))
+                            track.spilled[b] = True
+            if not blocks:
+                return None
+            driver_ids = sorted({b[0] for b in blocks})
+            index = {d: i for i, d in enumerate(driver_ids)}
+            keys = np.stack([b[1] for b in blocks])
+            first, last = keys[:, 0].min() // TIME_SCALE, keys[:, 0].max() // TIME_SCALE
+            # Last block may run past its keyframe by up to the block length; the name is a lower bound.
+            # A random suffix keeps workers sharing one spill directory from overwriting each other
+            path = os.path.join(self.spill_dir, f"traj-{first}-{last}-{uuid.uuid4().hex}.npz")
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                np.savez_compressed(
+                    path,
+                    drivers=np.array(driver_ids),
+                    block_driver=np.array([index[b[0]] for b in blocks], np.int32),
+                    keys=keys,
+                    deltas=np.stack([b[2] for b in blocks]),
+                    counts=np.array([b[3] for b in blocks], np.int32),
+                )
+            except OSError as e:
+                logger.warning("Trajectory spill error", extra={"path": path, "error": str(e)})
+                return None
+            self.spills += 1
+            return path
+
+    def _read_spilled(self, driver_id, start, end):
+        found = []
+        if not os.path.isdir(self.spill_dir):
+            return np.empty((0, 3), np.int64)
+        for name in os.listdir(self.spill_dir):
+            if not (name.startswith("traj-") and name.endswith(".npz")):
+                continue
+            # traj-{first}-{last}-{suffix}.npz
+            try:
+                first = int(name[len("traj-"):-len(".npz")].split("-")[0])
+            except ValueError:
+                continue
+            if end is not None and first > end:
+                continue
+            with np.load(os.path.join(self.spill_dir, name)) as data:
+                drivers = list(data["drivers"])
+                if driver_id not in drivers:
+                    continue
+                rows = np.flatnonzero(data["block_driver"] == drivers.index(driver_id))
+                keys, deltas, counts = data["keys"], data["deltas"], data["counts"]
+                found.extend(decode_block(keys[r], deltas[r], counts[r]) for r in rows)
+        if not found:
+            return np.empty((0, 3), np.int64)
+        points = np.concatenate(found)
+        return points[np.argsort(points[:, 0], kind="stable")]
+
+    def _ensure_started(self):
+        if self._thread is None and self.spill_dir and not self._stopped.is_set():
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trajectory-spill", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.spill()
+
+    def close(self):
+        """Stop the spiller and write everything not yet on disk"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        self.spill(include_open=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "drivers": len(self.tracks),
+                "points": self.points,
+                "bytes": sum(t.nbytes for t in self.tracks.values()),
+                "spills": self.spills,
+            }
+
+
+trajectories = TrajectoryStore()
+atexit.register(trajectories.close)
+change_feed.subscribe(trajectories.on_change)
@@ -0,0 +1,208 @@
+import argparse
+import logging
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Same service area as the client's geocoding viewbox
+CAMPUS_BOUNDS = {
+    "lat_min": 47.648546,
+    "lon_min": -122.333540,
+    "lat_max": 47.682512,
+    "lon_max": -122.270640,
+}
+
+EARTH_RADIUS_M = 6371000.0
+
+# Speed model used for off-grid pairs and as the error fallback
+AVG_SPEED_MPS = float(os.getenv("FALLBACK_SPEED_KMH", "25")) / 3.6
+ROAD_CIRCUITY = float(os.getenv("FALLBACK_CIRCUITY", "1.35"))
+FIXED_OVERHEAD_SECONDS = float(os.getenv("FALLBACK_OVERHEAD_SECONDS", "30"))
+
+
+# ----------------------------
+# Speed Model
+# ----------------------------
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters; accepts scalars or NumPy arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def estimate_seconds(lat1, lon1, lat2, lon2, overhead=FIXED_OVERHEAD_SECONDS):
+    """Drive-time estimate from straight-line distance, circuity and average speed"""
+    meters = haversine_meters(lat1, lon1, lat2, lon2)
+    seconds = overhead + meters * ROAD_CIRCUITY / AVG_SPEED_MPS
+    return np.where(meters > 0, seconds, 0.0)
+
+
+# ----------------------------
+# Travel-Time Matrix
+# ----------------------------
+class TravelTimeMatrix:
+    """
+    Precomputed drive times between cells of a uniform grid over the campus.
+    Pairs are answered by snapping both ends to their cell and adding the
+    speed-model time for the snap offsets; pairs outside the grid fall back
+    to the speed model alone.
+    """
+
+    def __init__(self, rows, cols, durations, bounds=CAMPUS_BOUNDS):
+        self.rows = rows
+        self.cols = cols
+        self.bounds = bounds
+        self.durations = np.asarray(durations, dtype=np.float32)
+        self.lat_step = (bounds["lat_max"] - bounds["lat_min"]) / rows
+        self.lon_step = (bounds["lon_max"] - bounds["lon_min"]) / cols
+        self.center_lats, self.center_lons = cell_centers(rows, cols, bounds)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        bounds = dict(zip(("lat_min", "lon_min", "lat_max", "lon_max"), data["bounds"].tolist()))
+        return cls(int(data["rows"]), int(data["cols"]), data["durations"], bounds)
+
+    def save(self, path):
+        b = self.bounds
+        np.savez_compressed(
+            path,
+            rows=self.rows,
+            cols=self.cols,
+            bounds=np.array([b["lat_min"], b["lon_min"], b["lat_max"], b["lon_max"]]),
+            durations=self.durations,
+        )
+
+    def contains(self, lats, lons):
+        b = self.bounds
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        return (lats >= b["lat_min"]) & (lats <= b["lat_max"]) & (lons >= b["lon_min"]) & (lons <= b["lon_max"])
+
+    def cell_index(self, lats, lons):
+        b = self.bounds
+        r = np.floor((np.asarray(lats, dtype=np.float64) - b["lat_min"]) / self.lat_step).astype(np.intp)
+        c = np.floor((np.asarray(lons, dtype=np.float64) - b["lon_min"]) / self.lon_step).astype(np.intp)
+        return np.clip(r, 0, self.rows - 1) * self.cols + np.clip(c, 0, self.cols - 1)
+
+    def estimate_many(self, origins, destinations):
+        """
+        Vectorized drive-time estimate in seconds.
+        origins / destinations are (n, 2) arrays of [lat, lon].
+        """
+        origins = np.atleast_2d(np.asarray(origins, dtype=np.float64))
+        destinations = np.atleast_2d(np.asarray(destinations, dtype=np.float64))
+        olat, olon = origins[:, 0], origins[:, 1]
+        dlat, dlon = destinations[:, 0], destinations[:, 1]
+
+        direct = estimate_seconds(olat, olon, dlat, dlon)
+        inside = self.contains(olat, olon) & self.contains(dlat, dlon)
+
+        oi = self.cell_index(olat, olon)
+        di = self.cell_index(dlat, dlon)
+        snapped = (
+            self.durations[oi, di]
+            + estimate_seconds(olat, olon, self.center_lats[oi], self.center_lons[oi], overhead=0)
+            + estimate_seconds(self.center_lats[di], self.center_lons[di], dlat, dlon, overhead=0)
+        )
+        # Same-cell pairs have no meaningful matrix entry; use the speed model
+        use_matrix = inside & (oi != di)
+        return np.where(use_matrix, snapped, direct)
+
+    def estimate(self, origin, destination):
+        """Single-pair estimate in seconds for {"lat", "lon"} dicts"""
+        seconds = self.estimate_many(
+            [[float(origin["lat"]), float(origin["lon"])]],
+            [[float(destination["lat"]), float(destination["lon"])]],
+        )
+        return int(round(float(seconds[0])))
+
+    def covers(self, origin, destination):
+        return bool(
+            self.contains(float(origin["lat"]), float(origin["lon"]))
+            and self.contains(float(destination["lat"]), float(destination["lon"]))
+        )
+
+
+def cell_centers(rows, cols, bounds=CAMPUS_BOUNDS):
+    """Flattened (row-major) lat/lon arrays of grid cell centers"""
+    lat_step = (bounds["lat_max"] - bounds["lat_min"]) / rows
+    lon_step = (bounds["lon_max"] - bounds["lon_min"]) / cols
+    lats = bounds["lat_min"] + (np.arange(rows) + 0.5) * lat_step
+    lons = bounds["lon_min"] + (np.arange(cols) + 0.5) * lon_step
+    grid_lats, grid_lons = np.meshgrid(lats, lons, indexing="ij")
+    return grid_lats.ravel(), grid_lons.ravel()
+
+
+def estimate_route_seconds(origin, destination):
+    """Speed-model estimate for one {"lat", "lon"} pair, used when no matrix applies"""
+    return int(round(float(estimate_seconds(
+        float(origin["lat"]), float(origin["lon"]),
+        float(destination["lat"]), float(destination["lon"]),
+    ))))
+
+
+def load_default_matrix():
+    path = os.getenv("TRAVEL_MATRIX_PATH", "travel_matrix.npz")
+    if not os.path.exists(path):
+        return None
+    try:
+        return TravelTimeMatrix.load(path)
+    except Exception as e:
+        logger.warning("Travel matrix load error", extra={"path": path, "error": str(e)})
+        return None
+
+
+travel_matrix = load_default_matrix()
+
+
+# ----------------------------
+# Offline Build
+# ----------------------------
+def build_matrix(rows, cols, block_size=10):
+    """
+    Precompute the grid matrix with Amazon Location CalculateRouteMatrix,
+    in blocks of block_size departures x block_size destinations.
+    Cells the calculator cannot route keep their speed-model estimate.
+    """
+    from db import location_client, ROUTE_CALCULATOR
+
+    lats, lons = cell_centers(rows, cols)
+    n = rows * cols
+    durations = estimate_seconds(lats[:, None], lons[:, None], lats[None, :], lons[None, :]).astype(np.float32)
+    positions = [[float(lon), float(lat)] for lat, lon in zip(lats, lons)]
+
+    for i in range(0, n, block_size):
+        for j in range(0, n, block_size):
+            response = location_client.calculate_route_matrix(
+                CalculatorName=ROUTE_CALCULATOR,
+                DeparturePositions=positions[i:i + block_size],
+                DestinationPositions=positions[j:j + block_size],
+                TravelMode="Car",
+                DistanceUnit="Kilometers",
+            )
+            for di, row in enumerate(response["RouteMatrix"]):
+                for dj, cell in enumerate(row):
+                    if "DurationSeconds" in cell and not cell.get("Error"):
+                        durations[i + di, j + dj] = cell["DurationSeconds"]
+        print(f"Built rows {i}-{min(i + block_size, n) - 1} of {n}")
+
+    np.fill_diagonal(durations, 0)
+    return TravelTimeMatrix(rows, cols, durations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the campus travel-time matrix")
+    parser.add_argument("--rows", type=int, default=12)
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--block-size", type=int, default=10)
+    parser.add_argument("--out", default=os.getenv("TRAVEL_MATRIX_PATH", "travel_matrix.npz"))
+    args = parser.parse_args()
+
+    matrix = build_matrix(args.rows, args.cols, args.block_size)
+    matrix.save(args.out)
+    print(f"Saved {args.rows}x{args.cols} grid ({matrix.durations.size} pairs) to {args.out}")
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "8"))
+SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "15"))
+IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "45"))
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Connection
+# ----------------------------
+class Connection:
+    """
+    One subscriber socket with its own bounded outbound queue and sender task.
+    Messages are keyed; a newer message replaces an unsent one with the same key.
+    """
+
+    def __init__(self, hub, websocket, ride_id):
+        self.hub = hub
+        self.websocket = websocket
+        self.ride_id = ride_id
+        self.pending = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self.sender = None
+
+    def enqueue(self, message, key):
+        if self.closed:
+            return
+        if key in self.pending:
+            self.hub.coalesced += 1
+        elif len(self.pending) >= MAX_QUEUE:
+            self.pending.popitem(last=False)
+            self.hub.dropped += 1
+        self.pending[key] = message
+        self.pending.move_to_end(key)
+        self.wakeup.set()
+
+    async def send_loop(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.pending and not self.closed:
+                    _, message = self.pending.popitem(last=False)
+                    await asyncio.wait_for(self.websocket.send_json(message), SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Slow (timed out) or dead socket: drop the subscriber
+            logger.info("Dropping slow or dead subscriber", extra={"ride_id": self.ride_id, "error": repr(e)})
+            await self.hub.disconnect(self)
+
+
+# ----------------------------
+# Server-Sent Events Channel
+# ----------------------------
+class SseStream:
+    """
+    Stands in for a WebSocket so SSE subscribers share the hub's queues,
+    coalescing and reaping. The HTTP response drains it; its one-slot buffer
+    makes a stalled reader hit the hub's send timeout like a slow socket.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=1)
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await self.queue.put(message)
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    async def messages(self, conn):
+        """Yield queued messages until closed; each delivery counts as liveness"""
+        while True:
+            message = await self.queue.get()
+            if message is None or self.closed:
+                return
+            conn.last_seen = time.monotonic()
+            yield message
+
+
+# ----------------------------
+# Broadcast Hub
+# ----------------------------
+class BroadcastHub:
+    """Fan-out of ride updates to WebSocket subscribers without blocking publishers"""
+
+    def __init__(self):
+        self.connections = {}  # ride_id -> set of Connection
+        self.coalesced = 0
+        self.dropped = 0
+        self.reaped = 0
+        self._reaper = None
+
+    async def connect(self, ride_id, websocket):
+        await websocket.accept()
+        conn = Connection(self, websocket, ride_id)
+        self.connections.setdefault(ride_id, set()).add(conn)
+        conn.sender = asyncio.create_task(conn.send_loop())
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+        return conn
+
+    async def receive_loop(self, conn):
+        """Read until the client goes away; any inbound frame (e.g. "pong") counts as liveness"""
+        try:
+            while not conn.closed:
+                await conn.websocket.receive_text()
+                conn.last_seen = time.monotonic()
+        except Exception:
+            pass
+        finally:
+            await self.disconnect(conn)
+
+    async def disconnect(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        conns = self.connections.get(conn.ride_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self.connections[conn.ride_id]
+        if conn.sender is not None and conn.sender is not asyncio.current_task():
+            conn.sender.cancel()
+        try:
+            await conn.websocket.close()
+        except Exception:
+            pass
+
+    def has_subscribers(self, ride_id):
+        return bool(self.connections.get(ride_id))
+
+    def subscribed_ride_ids(self):
+        return list(self.connections)
+
+    def publish(self, ride_id, message, key="status"):
+        """Queue a message for every subscriber of a ride; never awaits a socket"""
+        for conn in list(self.connections.get(ride_id, ())):
+            conn.enqueue(message, key)
+
+    async def _reap_loop(self):
+        while self.connections:
+            await asyncio.sleep(PING_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for conns in list(self.connections.values()):
+                for conn in list(conns):
+                    if now - conn.last_seen > IDLE_TIMEOUT_SECONDS:
+                        self.reaped += 1
+                        await self.disconnect(conn)
+                    else:
+                        conn.enqueue({"type": "ping"}, key="ping")
+
+    async def close(self):
+        for conns in list(self.connections.values()):
+            for conn in list(conns):
+                await self.disconnect(conn)
+        if self._reaper is not None:
+            self._reaper.cancel()
+
+    def metrics(self):
+        depths = [len(c.pending) for conns in self.connections.values() for c in conns]
+        return {
+            "rides": len(self.connections),
+            "connections": len(depths),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "reaped": self.reaped,
+        }
+
+
+hub = BroadcastHub()